@@ -1,21 +1,35 @@
 import discord
 from discord.ext import commands
 import asyncio
-import io
-import openpyxl
-import random
+import os
+import re
+import time
 from datetime import datetime
 import config
 from services.sheets_service import SheetsService
+from services import log_export
+from services.checkpoints import CheckpointStore
+from services.dm_fanout import DMFanout
+from services.resolver import Resolver
+from services.log_export import EXPORT_ROWS
+from utils import tracing
 
 class AdminCog(commands.Cog):
-    def __init__(self, bot, sheets_service: SheetsService):
+    def __init__(self, bot, sheets_service: SheetsService, checkpoints: CheckpointStore, resolver: Resolver):
         self.bot = bot
         self.sheets = sheets_service
+        self.checkpoints = checkpoints
+        self.resolver = resolver
+        self.dm_fanout = DMFanout(resolver, checkpoints)
+        self._running_scans = set() # tab names with a scan in progress
+        self._resumed_jobs = False
 
     @discord.slash_command(name="exportlog", description="Export channel history to Excel")
     @commands.has_role(config.ADMIN_ROLE_NAME)
-    async def exportlog(self, ctx, start_date: str, end_date: str):
+    async def exportlog(
+        self, ctx, start_date: str, end_date: str,
+        fmt: discord.Option(str, "File format", choices=list(log_export.FORMATS), default="xlsx", name="format"),
+    ):
         # Parse dates
         try:
             start_dt = datetime.strptime(start_date, "%Y-%m-%d")
@@ -26,13 +40,21 @@ class AdminCog(commands.Cog):
 
         await ctx.defer(ephemeral=True)
 
-        async def _generate():
-            wb = openpyxl.Workbook()
-            ws_excel = wb.active
-            ws_excel.append(["Date", "Author", "Content", "Reactions"])
+        limit_time = end_dt.replace(hour=23, minute=59, second=59)
+        export = log_export.StreamingExport(
+            fmt, f"log_{start_date}_{end_date}",
+            ["Date", "Author", "Content", "Reactions"],
+            log_export.upload_limit(guild=None), # parts go to the requester's DMs
+        )
+        progress = await ctx.followup.send("Exporting... 0 messages so far.", ephemeral=True)
+
+        try:
+            # History is read here on the loop; rows are serialized to disk in a
+            # worker thread one chunk at a time (see StreamingExport).
+            chunk = []
+            count = 0
+            last_progress = time.monotonic()
 
-            limit_time = end_dt.replace(hour=23, minute=59, second=59)
-            
             # Iterate history
             async for msg in ctx.channel.history(limit=None, after=start_dt, before=limit_time):
                 # Reactions summary: "emoji (count)"
@@ -43,35 +65,44 @@ class AdminCog(commands.Cog):
                 # Usually best to compare unaware or assume UTC.
                 # Ignoring complex TZ logic here for simplicity unless requested.
                 
-                row = [
+                chunk.append([
                     msg.created_at.strftime("%Y-%m-%d %H:%M:%S"),
                     str(msg.author),
                     msg.content,
                     reactions_str
-                ]
-                # openpyxl synchronous
-                ws_excel.append(row)
+                ])
+                count += 1
 
-            out = io.BytesIO()
-            wb.save(out)
-            out.seek(0)
-            return out
+                if len(chunk) >= config.EXPORT_CHUNK_ROWS:
+                    await export.write_rows(chunk)
+                    chunk = []
 
-        try:
-            # Run heavy work in executor? history is async, but openpyxl is sync.
-            # We can mix.
-            file_data = await _generate()
-            file = discord.File(file_data, filename=f"log_{start_date}_{end_date}.xlsx")
-            
-            # DM to requester
+                if time.monotonic() - last_progress >= config.EXPORT_PROGRESS_SECONDS:
+                    last_progress = time.monotonic()
+                    try:
+                        await progress.edit(content=f"Exporting... {count} messages so far.")
+                    except discord.HTTPException:
+                        pass
+
+            if chunk:
+                await export.write_rows(chunk)
+            paths = await export.finish()
+
+            # DM to requester, one attachment per part
             try:
-                await ctx.user.send("Here is the requested log export:", file=file)
-                await ctx.followup.send("Export sent to your DMs.", ephemeral=True)
+                for i, path in enumerate(paths):
+                    note = "Here is the requested log export:"
+                    if len(paths) > 1:
+                        note = f"Here is the requested log export (part {i + 1}/{len(paths)}):"
+                    await ctx.user.send(note, file=discord.File(path, filename=os.path.basename(path)))
+                await progress.edit(content=f"Export of {count} messages sent to your DMs.")
             except discord.Forbidden:
                 await ctx.followup.send("I couldn't DM you. Please enable DMs.", ephemeral=True)
                 
         except Exception as e:
             await ctx.followup.send(f"Export failed: {e}", ephemeral=True)
+        finally:
+            export.cleanup()
 
     @discord.slash_command(name="dmgroup", description="DM users from DMTargets sheet")
     @commands.has_role(config.ADMIN_ROLE_NAME)
@@ -85,10 +116,7 @@ class AdminCog(commands.Cog):
 
         ids = await self.sheets.get_all_values(ws)
         # Skip header? Prompt: "column A (skip header)"
-        targets = [row[0] for row in ids[1:] if row]
-        
-        failed = []
-        count = 0
+        targets = [row[0].strip() for row in ids[1:] if row and row[0].strip()]
         
         # ping channel
         if ping_channel:
@@ -97,46 +125,203 @@ class AdminCog(commands.Cog):
             except:
                 pass
 
-            try:
-                user = self.bot.get_user(int(uid))
-                if not user:
-                    user = await self.bot.fetch_user(int(uid))
-                
-                await user.send(message)
-                count += 1
-                # Random sleep 1-10s
-                await asyncio.sleep(random.randint(1, 10))
-            except Exception as e:
-                failed.append(uid)
+        reached = await self.dm_fanout.interrupted(message)
+        if reached:
+            note = f"Resuming an interrupted send to {len(targets)} users ({reached} already reached)..."
+        else:
+            note = f"Sending to {len(targets)} users..."
+        progress_msg = await ctx.followup.send(note, ephemeral=True)
+
+        async def _progress(sent, failed, total):
+            await progress_msg.edit(content=f"Sending... {sent}/{total} sent, {failed} failed.")
+
+        count, failed = await self.dm_fanout.run(targets, message, progress=_progress)
         
         summary = f"Sent to {count} users. Failed: {len(failed)}."
         if failed:
             summary += f"\nFailed IDs: {', '.join(failed)}"
         
-        await ctx.followup.send(summary, ephemeral=True)
+        await ctx.followup.send(summary[:2000], ephemeral=True)
 
     @discord.slash_command(name="getchannelusers", description="Export unique users in this channel")
     @commands.has_role(config.ADMIN_ROLE_NAME)
-    async def getchannelusers(self, ctx, sheet_name: str = "UserExport"):
-        await ctx.respond("Starting scan... I will notify you when done.", ephemeral=False)
+    async def getchannelusers(
+        self, ctx, sheet_name: str = "UserExport", extra_channels: str = None,
+        mode: discord.Option(str, "members = everyone who can see the channel (fast), history = people who actually posted", choices=["members", "history"], default="members") = "members",
+        since: discord.Option(str, "history mode only: ignore messages before YYYY-MM-DD", default=None) = None,
+    ):
+        # extra_channels: more channels to scan into the same export (mentions or IDs)
+        channels = [ctx.channel]
+        for cid in re.findall(r"\d{15,20}", extra_channels or ""):
+            channel = await self.resolver.get_channel(cid)
+            if channel and channel not in channels:
+                channels.append(channel)
+
+        if sheet_name in self._running_scans:
+            await ctx.respond(f"An export to '{sheet_name}' is already running.", ephemeral=True)
+            return
+
+        if mode == "members":
+            await ctx.respond("Exporting channel members... I will notify you when done.", ephemeral=False)
+            self.bot.loop.create_task(self._export_members(channels, sheet_name, ctx.channel))
+            return
+
+        since_dt = None
+        if since:
+            try:
+                since_dt = datetime.strptime(since, "%Y-%m-%d")
+            except ValueError:
+                await ctx.respond("Invalid date format. Use YYYY-MM-DD.", ephemeral=True)
+                return
+
+        if await self.checkpoints.load(f"scan_{sheet_name}"):
+            await ctx.respond("Resuming the previous scan from its checkpoint... I will notify you when done.", ephemeral=False)
+        else:
+            await ctx.respond("Starting scan... I will notify you when done.", ephemeral=False)
         
         # Run in background task
-        self.bot.loop.create_task(self._scan_users(ctx.channel, sheet_name))
+        self.bot.loop.create_task(self._scan_users(channels, sheet_name, ctx.channel, since_dt))
 
-    async def _scan_users(self, channel, sheet_tab_name):
+    async def _export_members(self, channels, sheet_tab_name, report_channel):
+        """
+        Fast path: exports every non-bot member who can view any of `channels`, taken from
+        the gateway member list (intents.members) instead of the message history.
+        """
+        self._running_scans.add(sheet_tab_name)
         try:
+            guild = channels[0].guild
+            if not guild.chunked:
+                # Ask the gateway for the full member list (member chunking)
+                await guild.chunk()
+
+            rows_to_add = []
+            for member in guild.members:
+                if member.bot:
+                    continue
+                if not any(c.permissions_for(member).view_channel for c in channels):
+                    continue
+                nick = member.nick if member.nick else member.name
+                rows_to_add.append([str(member.id), member.name, nick])
+
+            ws = await self.sheets.get_worksheet("DiscordBot", sheet_tab_name)
+            if not ws:
+                await report_channel.send(f"User export failed: sheet tab '{sheet_tab_name}' not found.")
+                return
+            await self.sheets.append_rows(ws, rows_to_add)
+            await report_channel.send(f"User export to '{sheet_tab_name}' complete. Found {len(rows_to_add)} members.")
+
+        except Exception as e:
+            await report_channel.send(f"User export failed: {e}")
+        finally:
+            self._running_scans.discard(sheet_tab_name)
+
+    @discord.slash_command(name="botstats", description="Admin: Command latency percentiles and slowest recent traces")
+    @commands.has_role(config.ADMIN_ROLE_NAME)
+    async def botstats(self, ctx):
+        stats = tracing.TRACER.percentiles()
+        lines = ["**Latency (ms)**", "```", f"{'name':<22}{'count':>7}{'p50':>8}{'p95':>8}{'p99':>8}"]
+        for name, s in sorted(stats.items(), key=lambda kv: kv[1]["p95"], reverse=True):
+            lines.append(
+                f"{name[:22]:<22}{s['count']:>7}{s['p50'] * 1000:>8.0f}{s['p95'] * 1000:>8.0f}{s['p99'] * 1000:>8.0f}"
+            )
+        lines.append("```")
+
+        slowest = tracing.TRACER.slowest(5)
+        if slowest:
+            lines.append("**Slowest recent traces**")
+            for t in slowest:
+                when = datetime.fromtimestamp(t.wall_time).strftime("%H:%M:%S")
+                flag = " (error)" if t.error else ""
+                lines.append(f"`{t.name}` {t.duration * 1000:.0f} ms at {when}{flag}")
+                for name, offset, duration, attrs, error in t.spans[:8]:
+                    detail = ", ".join(f"{k}={v}" for k, v in attrs.items())
+                    lines.append(
+                        f"  +{offset * 1000:.0f} ms {name}{f' [{detail}]' if detail else ''}: {duration * 1000:.0f} ms{' ✗' if error else ''}"
+                    )
+                if len(t.spans) > 8:
+                    lines.append(f"  ... {len(t.spans) - 8} more spans")
+
+        q = self.sheets.request_stats()
+        lines.append(f"Sheets: {q['queued']} queued, {q['in_flight']} in flight, {q['retries']} retries, {q['pending_writes']} pending writes")
+
+        msg = "\n".join(lines)
+        if len(msg) > 1990:
+            msg = msg[:1990] + "…"
+        await ctx.respond(msg, ephemeral=True)
+
+    @commands.Cog.listener()
+    @tracing.traced("on_ready")
+    async def on_ready(self):
+        # Pick up scans that were interrupted by a crash/restart (once per process)
+        if self._resumed_jobs:
+            return
+        self._resumed_jobs = True
+
+        for name in self.checkpoints.names("scan_"):
+            state = await self.checkpoints.load(name)
+            if not state or state.get("tab") in self._running_scans:
+                continue
+            channels = []
+            for cid in state.get("channels", {}):
+                channel = await self.resolver.get_channel(cid)
+                if channel:
+                    channels.append(channel)
+            report = await self.resolver.get_channel(state.get("report_channel_id", 0)) or (channels[0] if channels else None)
+            if not channels or not report:
+                continue
+            print(f"Resuming user export to '{state['tab']}' from checkpoint")
+            self.bot.loop.create_task(self._scan_users(channels, state["tab"], report))
+
+    async def _scan_users(self, channels, sheet_tab_name, report_channel, since_dt=None):
+        """
+        "Actually posted" mode: scans the history of `channels` back to `since_dt` (or the
+        start), concurrently and merged into one de-duplicated set, and bulk-appends the
+        users to `sheet_tab_name`. Progress is checkpointed so an
+        interrupted run continues from the last saved message / exported row.
+        """
+        checkpoint = f"scan_{sheet_tab_name}"
+        self._running_scans.add(sheet_tab_name)
+        try:
+            state = await self.checkpoints.load(checkpoint) or {
+                "tab": sheet_tab_name,
+                "report_channel_id": report_channel.id,
+                "channels": {}, # channel_id -> {"before": last message id seen, "done": bool}
+                "users": {}, # user_id -> [username, nickname]
+                "exported": 0, # rows already appended to the sheet
+                "since": since_dt.isoformat() if since_dt else None,
+            }
+            # A resumed scan keeps the date bound it was started with
+            since_dt = datetime.fromisoformat(state["since"]) if state.get("since") else None
+            for channel in channels:
+                state["channels"].setdefault(str(channel.id), {"before": None, "done": False})
+
             # "scan full channel history, collect unique non-bot authors"
-            unique_users = {} # ID -> (Username, Nickname)
-            
-            async for msg in channel.history(limit=None):
-                if not msg.author.bot:
-                    if msg.author.id not in unique_users:
-                        # Get nickname
-                        nick = msg.author.display_name # fallback
-                        if isinstance(msg.author, discord.Member):
-                            nick = msg.author.nick if msg.author.nick else msg.author.name
-                        
-                        unique_users[msg.author.id] = (msg.author.name, nick)
+            unique_users = state["users"] # ID -> (Username, Nickname)
+
+            async def _scan(channel):
+                pos = state["channels"][str(channel.id)]
+                if pos["done"]:
+                    return
+                before = discord.Object(id=pos["before"]) if pos["before"] else None
+                seen = 0
+                # Newest first (explicit: passing `after` would flip the default), so `before` is the resume point
+                async for msg in channel.history(limit=None, before=before, after=since_dt, oldest_first=False):
+                    if not msg.author.bot:
+                        if str(msg.author.id) not in unique_users:
+                            # Get nickname
+                            nick = msg.author.display_name # fallback
+                            if isinstance(msg.author, discord.Member):
+                                nick = msg.author.nick if msg.author.nick else msg.author.name
+                            
+                            unique_users[str(msg.author.id)] = [msg.author.name, nick]
+                    pos["before"] = msg.id
+                    seen += 1
+                    if seen % config.SCAN_CHECKPOINT_EVERY == 0:
+                        await self.checkpoints.save(checkpoint, state)
+                pos["done"] = True
+                await self.checkpoints.save(checkpoint, state)
+
+            await asyncio.gather(*[_scan(c) for c in channels])
             
             # Export to sheet
             ws = await self.sheets.get_worksheet("DiscordBot", sheet_tab_name)
@@ -146,26 +331,30 @@ class AdminCog(commands.Cog):
             # Simplest: append rows.
             
             if not ws:
-                 # Create logic was inside get_worksheet for "UserExport", but if user provided custom name?
-                 # My sheets service only auto-creates "CrashLogs" or "UserExport".
-                 # I should update sheets service or handle it there.
-                 # Let's assume the helper handles creation or returns None.
-                 # If None, maybe we can't do it.
-                 pass
-
-            if ws:
-                rows_to_add = []
-                for uid, (uname, nick) in unique_users.items():
-                    rows_to_add.append([str(uid), uname, nick])
-                
-                # Batch append? gspread usually one by one or append_rows.
-                # Use append_rows if available in Service wrapper (I only made append_row).
-                # I'll loop append_row for now (slow but matches spec "best effort").
-                # Or improve service.
-                for r in rows_to_add:
-                    await self.sheets.append_row(ws, r)
-            
-            await channel.send(f"User export to '{sheet_tab_name}' complete. Found {len(unique_users)} users.")
+                # Only "UserExport"/"CrashLogs" are auto-created; keep the checkpoint so
+                # the scan isn't lost once the tab exists
+                await report_channel.send(
+                    f"User export failed: sheet tab '{sheet_tab_name}' not found "
+                    "(scan saved, create the tab and run the command again to resume)."
+                )
+                return
+
+            rows_to_add = [[uid, uname, nick] for uid, (uname, nick) in unique_users.items()]
+            already = state["exported"]
+
+            async def _exported(done):
+                state["exported"] = already + done
+                await self.checkpoints.save(checkpoint, state)
+
+            # Chunked append_rows; dict order survives the checkpoint, so skipping
+            # the rows exported before an interruption is just a slice
+            await self.sheets.append_rows(ws, rows_to_add[already:], on_chunk=_exported)
+            EXPORT_ROWS.inc(len(rows_to_add) - already, format="sheet")
+
+            await self.checkpoints.delete(checkpoint)
+            await report_channel.send(f"User export to '{sheet_tab_name}' complete. Found {len(unique_users)} users.")
             
         except Exception as e:
-            await channel.send(f"User export failed: {e}")
+            await report_channel.send(f"User export failed (progress saved, run the command again to resume): {e}")
+        finally:
+            self._running_scans.discard(sheet_tab_name)
@@ -1,93 +1,188 @@
 import discord
 from discord.ext import commands, tasks
 import asyncio
-import aiohttp
+from datetime import timedelta
 from io import BytesIO
 import config
-from utils import drive, time_utils
-from services.sheets_service import SheetsService
+from utils import metrics, time_utils, tracing
+from services.sheets_service import SheetsService, PRIORITY_SCHEDULER
+from services.schedule_engine import ScheduleEngine
+from services.attachment_cache import AttachmentCache
+from services.resolver import Resolver
+
+LAG_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+SCHEDULE_LAG = metrics.histogram("schedule_lag_seconds", "Due time to start of the send", buckets=LAG_BUCKETS)
+SCHEDULE_SEND = metrics.histogram("schedule_send_seconds", "Time to send one scheduled post")
+SCHEDULE_POSTS = metrics.counter("schedule_posts_total", "Scheduled posts sent, by outcome", ("outcome",))
 
 class SchedulerCog(commands.Cog):
-    def __init__(self, bot, sheets_service: SheetsService):
+    def __init__(self, bot, sheets_service: SheetsService, attachments: AttachmentCache, resolver: Resolver):
         self.bot = bot
         self.sheets = sheets_service
-        self.schedule_loop.start()
+        self.attachments = attachments
+        self.resolver = resolver
+        self.engine = ScheduleEngine(catchup_minutes=config.SCHEDULE_CATCHUP_MINUTES)
+        self._wakeup = asyncio.Event()
+        self._loaded = asyncio.Event()
+        self._send_limit = asyncio.Semaphore(config.SCHEDULE_SEND_CONCURRENCY)
+        self._reaction_queues = {} # channel_id -> asyncio.Queue of (message, emoji)
+        metrics.add_collector(self._collect_metrics)
+        self.refresh_loop.start()
+        self.dispatch_loop.start()
 
     def cog_unload(self):
-        self.schedule_loop.cancel()
+        self.refresh_loop.cancel()
+        self.dispatch_loop.cancel()
 
-    @tasks.loop(minutes=1)
-    async def schedule_loop(self):
+    @tasks.loop(minutes=config.SCHEDULE_REFRESH_MINUTES)
+    async def refresh_loop(self):
+        """Re-reads the Schedule tab into the engine's heap (skipped if the tab is unchanged)."""
         try:
-            current_time = time_utils.get_current_time()
-            # Format: H:MM or HH:MM? The prompt says "Match current minute".
-            # Usually we compare H:MM to the sheet's time string.
-            current_time_str = current_time.strftime("%H:%M").lstrip('0') # "8:05"
-            current_time_str_padded = current_time.strftime("%H:%M") # "08:05"
-            current_date_str = current_time.strftime("%Y-%m-%d")
-
-            ws = await self.sheets.get_worksheet("DiscordBot", "Schedule")
+            if not self._loaded.is_set():
+                # A post sent right before a crash may have its Sent=TRUE still in the
+                # journal; reading the tab before it is replayed would post it again
+                await self.sheets.journal_done.wait()
+            ws = await self.sheets.get_worksheet("DiscordBot", "Schedule", priority=PRIORITY_SCHEDULER)
             if not ws:
                 print("Schedule sheet not found")
                 return
 
-            rows = await self.sheets.get_all_values(ws)
-            if len(rows) < 2:
-                return # header only or empty
+            # Cheap when nothing changed; otherwise only the changed rows get re-parsed
+            diff = await self.sheets.get_values_if_changed(
+                ws, force=not self._loaded.is_set(), priority=PRIORITY_SCHEDULER
+            )
+            if diff is not None:
+                if not self._loaded.is_set():
+                    self.engine.load(diff["rows"])
+                else:
+                    self.engine.apply_changes(diff["inserted"] + diff["changed"], diff["removed"])
+                self._loaded.set()
+                self._wakeup.set() # next fire time may have moved
+
+            # Download attachments of soon-due posts now so the send is on time
+            horizon = time_utils.get_current_time() + timedelta(minutes=config.ATTACHMENT_PREFETCH_MINUTES)
+            for post in self.engine.upcoming(horizon):
+                if post["attach_url"]:
+                    asyncio.ensure_future(self.attachments.prefetch(post["attach_url"]))
+        except Exception as e:
+            print(f"Scheduler Refresh Error: {e}")
+
+    @refresh_loop.before_loop
+    async def before_refresh_loop(self):
+        await self.bot.wait_until_ready()
 
-            # Schedule columns: A=Content(0), B=Date(1), C=Time(2), D=Sent(3), E=Attach(4), F=ChannelID(5), G=Mentions(6), H=Reactions(7)
-            
-            # Identify updates needed
-            updates = [] # (row_idx, col_idx, value)
-
-            for i, row in enumerate(rows[1:]): # skip header
-                row_idx = i + 2 # 1-based index in sheet
-
-                # Safe access
-                def get_col(idx):
-                    return row[idx] if len(row) > idx else ""
-
-                content = get_col(0)
-                date_val = get_col(1)
-                time_val = get_col(2)
-                sent_flag = get_col(3)
-                attach_url = get_col(4)
-                channel_id_str = get_col(5)
-                mentions = get_col(6)
-                reactions = get_col(7)
-
-                if sent_flag.upper() == "TRUE":
-                    continue
-
-                # Check Match
-                # Handle varying time formats
-                # If time_val in sheet is "8:05" or "08:05", match either
-                time_match = (time_val == current_time_str or time_val == current_time_str_padded)
-                date_match = (date_val == current_date_str)
-
-                if date_match and time_match:
-                    # SEND MESSAGE
-                    await self.send_message(
-                        row_idx, content, attach_url, channel_id_str, mentions, reactions
-                    )
+    @tasks.loop(seconds=0)
+    async def dispatch_loop(self):
+        """Sleeps until the next due post (or a refresh), then sends everything that is due."""
+        try:
+            await self._loaded.wait()
+
+            next_at = self.engine.next_fire_time()
+            if next_at is not None:
+                delay = (next_at - time_utils.get_current_time()).total_seconds()
+            else:
+                delay = None
+
+            if delay is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            due = self.engine.pop_due(time_utils.get_current_time())
+            if due:
+                await self.dispatch(due)
 
         except Exception as e:
             print(f"Scheduler Loop Error: {e}")
-            # If we want to log unique errors to crash log we could, but don't spam
-            # self.bot.crash_logger.log_crash_sync(e) # Wait, need access to crash logger
-            pass
+            # Repeats of the same error are collapsed by the crash logger
+            crash_logger = getattr(self.bot, "crash_logger", None)
+            if crash_logger:
+                await crash_logger.log_crash(e)
+            await asyncio.sleep(5)
+
+    @tracing.traced("schedule.dispatch")
+    async def dispatch(self, posts):
+        """
+        Sends a batch of due posts concurrently (at most SCHEDULE_SEND_CONCURRENCY at once)
+        and prints how late / how long each row took.
+        """
+        async def _one(post):
+            async with self._send_limit:
+                started = time_utils.get_current_time()
+                ok = await self.send_message(
+                    post["row_idx"], post["content"], post["attach_url"],
+                    post["channel_id"], post["mentions"], post["reactions"]
+                )
+                finished = time_utils.get_current_time()
+                lag = (started - post["fire_at"]).total_seconds()
+                took = (finished - started).total_seconds()
+                SCHEDULE_LAG.observe(max(0.0, lag))
+                SCHEDULE_SEND.observe(took)
+                SCHEDULE_POSTS.inc(outcome="ok" if ok else "failed")
+                return post, ok, lag, took
+
+        results = await asyncio.gather(*[_one(p) for p in posts])
+        report = ", ".join(
+            f"row {post['row_idx']}: {'ok' if ok else 'FAILED'} lag {lag:.1f}s send {took:.2f}s"
+            for post, ok, lag, took in results
+        )
+        print(f"Scheduled batch of {len(results)}: {report}")
+        return results
+
+    def _collect_metrics(self):
+        return [
+            ("schedule_pending_posts", "gauge", "Scheduled posts waiting for their time", [({}, len(self.engine))]),
+            ("schedule_pending_reactions", "gauge", "Reactions queued across channels",
+             [({}, sum(q.qsize() for q in self._reaction_queues.values()))]),
+        ]
+
+    def _queue_reactions(self, msg, emojis):
+        """
+        Reactions share one rate-limit bucket per channel, so each channel gets a single
+        worker that applies them in order (REACTION_INTERVAL apart). Posts in other
+        channels, and the next post in this one, don't wait for them.
+        """
+        channel_id = msg.channel.id
+        queue = self._reaction_queues.get(channel_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._reaction_queues[channel_id] = queue
+            asyncio.ensure_future(self._reaction_worker(channel_id, queue))
+        for e in emojis:
+            queue.put_nowait((msg, e))
+
+    async def _reaction_worker(self, channel_id, queue):
+        try:
+            while True:
+                try:
+                    msg, emoji = await asyncio.wait_for(queue.get(), timeout=30)
+                except asyncio.TimeoutError:
+                    break # idle; a new worker is started on demand
+                try:
+                    await msg.add_reaction(emoji)
+                except Exception:
+                    pass # Ignore invalid emojis
+                await asyncio.sleep(config.REACTION_INTERVAL)
+        finally:
+            if self._reaction_queues.get(channel_id) is queue:
+                del self._reaction_queues[channel_id]
+            # Anything that raced in after the timeout goes to a fresh worker
+            leftover = []
+            while not queue.empty():
+                leftover.append(queue.get_nowait())
+            for msg, emoji in leftover:
+                self._queue_reactions(msg, [emoji])
 
     async def send_message(self, row_idx, content, attach_url, channel_id_str, mentions, reactions):
         try:
             channel_id = int(channel_id_str)
-            channel = self.bot.get_channel(channel_id)
+            # Gateway cache, then the shared resolver cache, then REST
+            channel = await self.resolver.get_channel(channel_id)
             if not channel:
-                # Try fetch?
-                try:
-                    channel = await self.bot.fetch_channel(channel_id)
-                except:
-                    print(f"Channel {channel_id} not found")
-                    return
+                print(f"Channel {channel_id} not found")
+                return False
 
             final_content = content
             if mentions:
@@ -95,39 +190,31 @@ class SchedulerCog(commands.Cog):
 
             files = []
             if attach_url:
-                dl_url = drive.convert_drive_url(attach_url)
-                if dl_url.startswith("http"):
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(dl_url) as resp:
-                            if resp.status == 200:
-                                data = await resp.read()
-                                # Filename? Try to get from header or default
-                                filename = "attachment.png" # Simple default
-                                files.append(discord.File(BytesIO(data), filename=filename))
+                # Usually already on disk thanks to the refresh-time prefetch
+                attachment = await self.attachments.get(attach_url)
+                if attachment:
+                    data, filename = attachment
+                    files.append(discord.File(BytesIO(data), filename=filename))
 
             msg = await channel.send(final_content, files=files)
 
-            # Reactions
+            # Reactions (applied in the background, see _queue_reactions)
             if reactions:
-                emojis = reactions.split()
-                for e in emojis:
-                    try:
-                        await msg.add_reaction(e)
-                    except:
-                        pass # Ignore invalid emojis
+                self._queue_reactions(msg, reactions.split())
 
             # Mark Sent
-            ws_schedule = await self.sheets.get_worksheet("DiscordBot", "Schedule")
-            task1 = self.sheets.update_cell(ws_schedule, row_idx, 4, "TRUE")
+            ws_schedule = await self.sheets.get_worksheet("DiscordBot", "Schedule", priority=PRIORITY_SCHEDULER)
+            writes = [self.sheets.update_cell(ws_schedule, row_idx, 4, "TRUE", priority=PRIORITY_SCHEDULER)]
             
             # Log to Logs
             ws_logs = await self.sheets.get_worksheet("DiscordBot", "Logs")
             if ws_logs:
                 ts = time_utils.get_current_time().isoformat()
-                task2 = self.sheets.append_row(ws_logs, [ts, str(channel_id), row_idx, content])
+                writes.append(self.sheets.append_row(ws_logs, [ts, str(channel_id), row_idx, content]))
                 
-            await asyncio.gather(task1, task2)
+            await asyncio.gather(*writes)
+            return True
 
         except Exception as e:
             print(f"Failed to send scheduled msg row {row_idx}: {e}")
-
+            return False
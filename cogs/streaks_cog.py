@@ -1,15 +1,57 @@
 import discord
-from discord.ext import commands
+import time
+from discord.ext import commands, tasks
 import config
-from utils import cooldown
+from utils import cooldown, metrics, time_utils, tracing
 from services.streak_service import StreakService
 
+STREAK_UPDATE = metrics.histogram(
+    "streak_update_seconds", "on_message to streak reply (or to the update, when no reply is due)",
+    ("outcome",),
+)
+
 class StreaksCog(commands.Cog):
     def __init__(self, bot, streak_service: StreakService):
         self.bot = bot
         self.streak_service = streak_service
+        self._top_cache = None # (leaderboard.top_version, rendered message)
+
+        # Users whose streak was already recorded today; reset at local midnight
+        self._touched_today = set()
+        self._touched_date = None
+        self.sync_loop.start()
+
+    def cog_unload(self):
+        self.sync_loop.cancel()
+
+    @tasks.loop(minutes=config.STREAK_SYNC_MINUTES)
+    async def sync_loop(self):
+        # Pick up manual edits made directly in the Streaks tab
+        try:
+            await self.streak_service.sync()
+        except Exception as e:
+            print(f"Streak sync loop error: {e}")
+
+    @sync_loop.before_loop
+    async def before_sync_loop(self):
+        await self.bot.wait_until_ready()
+
+    def _first_touch_today(self, user_id):
+        """
+        True the first time a user is seen on the current local date (UTC + TIMEZONE_OFFSET).
+        Later messages that day have nothing new to record and are dropped here.
+        """
+        today = time_utils.get_current_time().date()
+        if today != self._touched_date:
+            self._touched_today.clear()
+            self._touched_date = today
+        if user_id in self._touched_today:
+            return False
+        self._touched_today.add(user_id)
+        return True
 
     @commands.Cog.listener()
+    @tracing.traced("on_message")
     async def on_message(self, message):
         if message.author.bot:
             return
@@ -18,27 +60,51 @@ class StreaksCog(commands.Cog):
         if config.STREAK_CHANNEL_ID and message.channel.id != config.STREAK_CHANNEL_ID:
             return
             
+        # Fast path: already ticked today
+        if not self._first_touch_today(message.author.id):
+            return
+
+        started = time.perf_counter()
+
         # Update username in sheet and tick streak
         # "One streak '🔥 …' message per user per day"
-        new_streak, shown_date = await self.streak_service.update_streak(
-            message.author.id, message.author.name
-        )
-        
+        with tracing.span("streak.update"):
+            new_streak, shown_date = await self.streak_service.update_streak(
+                message.author.id, message.author.name
+            )
+
+        if new_streak is None:
+            # Sheet unavailable, let the next message try again
+            self._touched_today.discard(message.author.id)
+            STREAK_UPDATE.observe(time.perf_counter() - started, outcome="error")
+            return
+
         if new_streak:
-            today_str = config.get_current_time().strftime("%Y-%m-%d")
+            today_str = time_utils.get_current_time().strftime("%Y-%m-%d")
             # If shown_date != today, send message and mark shown
             if shown_date != today_str:
-                await message.reply(f"🔥 Current streak for {message.author.mention}: {new_streak} days!")
+                with tracing.span("discord.reply"):
+                    await message.reply(f"🔥 Current streak for {message.author.mention}: {new_streak} days!")
+                STREAK_UPDATE.observe(time.perf_counter() - started, outcome="reply")
                 await self.streak_service.mark_shown(message.author.id, today_str)
+                return
+        STREAK_UPDATE.observe(time.perf_counter() - started, outcome="silent")
 
     @discord.slash_command(name="streak", description="Show your current streak")
     @cooldown.apply_cooldown()
     async def streak(self, ctx):
         # "should also update/touch streak like current behavior"
-        new_streak, shown_date = await self.streak_service.update_streak(
-            ctx.author.id, ctx.author.name
-        )
-        await ctx.respond(f"🔥 {ctx.author.mention}, your streak is: {new_streak} days!")
+        with tracing.span("streak.update"):
+            new_streak, shown_date = await self.streak_service.update_streak(
+                ctx.author.id, ctx.author.name
+            )
+        with tracing.span("streak.rank"):
+            rank, total = await self.streak_service.get_rank(ctx.author.id)
+        msg = f"🔥 {ctx.author.mention}, your streak is: {new_streak} days!"
+        if rank:
+            msg += f" (Rank #{rank} of {total})"
+        with tracing.span("discord.respond"):
+            await ctx.respond(msg)
         
         # Should we mark shown? Usually explicit checks don't burn the daily notification if it wasn't automatic, but prompt says "One streak... per day".
         # If they check it manually, maybe that counts as the "message"? 
@@ -49,7 +115,15 @@ class StreaksCog(commands.Cog):
     @discord.slash_command(name="topstreaks", description="Show top streaks leaderboard")
     @cooldown.apply_cooldown()
     async def topstreaks(self, ctx):
-        top = await self.streak_service.get_top_streaks(limit=10)
+        # Re-render only when the top of the leaderboard actually changed
+        version = self.streak_service.leaderboard.top_version
+        if self._top_cache and self._top_cache[0] == version:
+            with tracing.span("discord.respond", cached=True):
+                await ctx.respond(self._top_cache[1])
+            return
+
+        with tracing.span("streak.top"):
+            top = await self.streak_service.get_top_streaks(limit=10)
         if not top:
             await ctx.respond("No streaks found.", ephemeral=True)
             return
@@ -60,8 +134,10 @@ class StreaksCog(commands.Cog):
             username = entry.get('Username', 'Unknown')
             streak = entry.get('Streak', 0)
             msg += f"{i+1}. {username}: {streak} 🔥\n"
-        
-        await ctx.respond(msg)
+
+        self._top_cache = (self.streak_service.leaderboard.top_version, msg)
+        with tracing.span("discord.respond"):
+            await ctx.respond(msg)
 
     @discord.slash_command(name="resetstreak", description="Admin: Reset a user's streak")
     @commands.has_role(config.ADMIN_ROLE_NAME)
@@ -71,3 +147,13 @@ class StreaksCog(commands.Cog):
             await ctx.respond(f"Reset streak for {user.mention}.", ephemeral=True)
         else:
             await ctx.respond(f"Could not find entry for {user.mention}.", ephemeral=True)
+
+    @discord.slash_command(name="resyncstreaks", description="Admin: Reload streaks from the sheet")
+    @commands.has_role(config.ADMIN_ROLE_NAME)
+    async def resyncstreaks(self, ctx):
+        await ctx.defer(ephemeral=True)
+        count = await self.streak_service.sync(force=True)
+        if count is None:
+            await ctx.followup.send("Could not read the Streaks sheet.", ephemeral=True)
+        else:
+            await ctx.followup.send(f"Reloaded {count} streaks from the sheet.", ephemeral=True)
@@ -7,6 +7,29 @@ DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 CREDENTIALS_B64 = os.getenv("CREDENTIALS_B64")
 BOT_OWNER_ID = int(os.getenv("BOT_OWNER_ID", 0))
 PORT = int(os.getenv("PORT", 8080))
+HEALTH_LOOP_STALL_SECONDS = 5 # /healthz fails if the event loop lags this much
+
+# Event loop monitor: lag is sampled every LOOP_MONITOR_INTERVAL seconds and lag above
+# LOOP_LAG_REPORT_SECONDS goes to the crash log (at most once per LOOP_REPORT_COOLDOWN).
+# SLOW_CALLBACK_DETECTOR=1 also samples the stack of anything blocking the loop for
+# more than SLOW_CALLBACK_SECONDS.
+LOOP_MONITOR_INTERVAL = 0.5
+LOOP_LAG_REPORT_SECONDS = 2.0
+LOOP_REPORT_COOLDOWN = 300
+SLOW_CALLBACK_DETECTOR = os.getenv("SLOW_CALLBACK_DETECTOR", "0") == "1"
+SLOW_CALLBACK_SECONDS = float(os.getenv("SLOW_CALLBACK_SECONDS", 0.25))
+
+# Crash reports: bounded queue, batch interval, dedup window for identical tracebacks,
+# per-minute cap, and the spool holding reports the CrashLogs tab doesn't have yet
+CRASH_QUEUE_SIZE = 500
+CRASH_FLUSH_SECONDS = 5
+CRASH_DEDUP_WINDOW = 600
+CRASH_MAX_PER_MINUTE = 10
+CRASH_SPOOL_PATH = "crash_spool.jsonl"
+
+# Span tracing (/botstats): recent traces kept, and durations kept per command for percentiles
+TRACE_BUFFER_SIZE = 200
+TRACE_SAMPLES = 500
 
 # Constants
 TIMEZONE_OFFSET = 3
@@ -16,5 +39,87 @@ STREAK_CHANNEL_ID = None # Will be set/used in cogs, or logic if specific ID was
 # Let's assume STREAK_CHANNEL_ID is meant to be configured. Since the user said "Keep environment variables exactly... DISCORD_BOT_TOKEN...", I shouldn't add new ones if strictly forbidden, but STREAK_CHANNEL_ID allows the feature to work. I will add it as valid config, reading from env if possible, else 0.
 STREAK_CHANNEL_ID = int(os.getenv("STREAK_CHANNEL_ID", 0))
 
+# Sheets: how long (seconds) to reuse opened spreadsheet/worksheet handles
+HANDLE_CACHE_TTL = 600
+
+# Sheets API quota (~60 requests/min/user): token bucket rate and burst, and how many
+# times a 429/5xx is retried with exponential backoff
+SHEETS_RATE_PER_MINUTE = 55
+SHEETS_BURST = 10
+SHEETS_MAX_RETRIES = 5
+
+# Threads reserved for blocking gspread calls (separate from the default executor)
+SHEETS_WORKERS = 4
+
+# Refresh the Sheets access token this many seconds before it expires
+SHEETS_TOKEN_REFRESH_MARGIN = 300
+
+# Sheets write-behind queue: flush after this many seconds or this many pending writes
+WRITE_FLUSH_INTERVAL = 1.0
+WRITE_BATCH_MAX = 50
+# Local journal of queued Sheets writes, replayed on startup if they never got sent
+JOURNAL_PATH = "sheets_journal.jsonl"
+JOURNAL_FSYNC = False # True also survives power loss, at the cost of an fsync per write
+JOURNAL_COMPACT_BYTES = 1024 * 1024 # rewrite the journal once it grows past this
+# Rows per request for bulk appends (SheetsService.append_rows)
+SHEETS_APPEND_CHUNK = 500
+
+# Where streaks live: "sqlite" = local SQLite file is the source of truth and the
+# Streaks tab is a mirror; "sheets" = the Streaks tab only (old behaviour)
+STREAK_STORE = "sqlite"
+SQLITE_PATH = "bot.db"
+
+# How often (minutes) StreakService re-reads the Streaks tab to pick up manual edits
+STREAK_SYNC_MINUTES = 10
+
+# Scheduler: re-read the Schedule tab every N minutes; rows missed while offline are
+# still sent if they are at most SCHEDULE_CATCHUP_MINUTES late
+SCHEDULE_REFRESH_MINUTES = 2
+SCHEDULE_CATCHUP_MINUTES = 720
+# Max scheduled posts sent at once, and spacing (seconds) between reactions in one channel
+SCHEDULE_SEND_CONCURRENCY = 5
+REACTION_INTERVAL = 0.25
+
+# /exportlog: rows per write chunk, progress message interval. Parts are sized to the
+# destination's attachment limit (guild.filesize_limit, or DM_FILESIZE_LIMIT for DMs)
+# minus EXPORT_SIZE_MARGIN for the upload's own overhead
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_PROGRESS_SECONDS = 10
+DM_FILESIZE_LIMIT = 10 * 1024 * 1024
+EXPORT_SIZE_MARGIN = 64 * 1024
+
+# Resumable admin jobs (/getchannelusers scans, ...) keep their progress here
+CHECKPOINT_DIR = "checkpoints"
+SCAN_CHECKPOINT_EVERY = 2000 # messages between scan checkpoints
+
+# /dmgroup fan-out: token bucket start/min/max rate (DMs per second), burst size,
+# concurrent senders, attempts per user and progress update interval (seconds)
+DM_RATE_PER_SEC = 1.0
+DM_MIN_RATE_PER_SEC = 0.2
+DM_MAX_RATE_PER_SEC = 2.0
+DM_BURST = 5
+DM_WORKERS = 4
+DM_MAX_ATTEMPTS = 3
+DM_PROGRESS_SECONDS = 15
+# py-cord sleeps through 429s inside send(), so a rate limit shows up as a slow send:
+# one taking DM_SLOW_SEND_FACTOR x the usual time (and at least DM_SLOW_SEND_SECONDS)
+# counts as throttled. The rate is halved at most once per DM_THROTTLE_COOLDOWN seconds,
+# and a send that still fails with 429 after py-cord's retries waits DM_THROTTLE_BACKOFF.
+DM_SLOW_SEND_SECONDS = 2.0
+DM_SLOW_SEND_FACTOR = 4
+DM_THROTTLE_COOLDOWN = 5
+DM_THROTTLE_BACKOFF = 10
+
+# Shared user/channel resolver: LRU size, TTL for found / not-found IDs (seconds)
+RESOLVER_CACHE_SIZE = 5000
+RESOLVER_TTL = 3600
+RESOLVER_NEGATIVE_TTL = 300
+
+# Shared HTTP session (Drive downloads etc.) and the on-disk attachment cache
+HTTP_POOL_SIZE = 20
+ATTACHMENT_CACHE_DIR = "attachment_cache"
+ATTACHMENT_CACHE_MAX_MB = 200
+ATTACHMENT_PREFETCH_MINUTES = 10
+
 # User Agent or other identifying info if needed
 # (None strictly required by prompt)
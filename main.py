@@ -4,11 +4,18 @@ import sys
 import time
 import asyncio
 import traceback
+import aiohttp
 import config
-import webserver # Keepalive
+from webserver import HealthServer # Keepalive / health checks
 from services.sheets_service import SheetsService
 from services.streak_service import StreakService
+from services.storage import StreakStore, SQLiteStreakStore
 from services.crash_logger import CrashLogger
+from services.loop_monitor import LoopMonitor
+from services.attachment_cache import AttachmentCache
+from services.checkpoints import CheckpointStore
+from services.resolver import Resolver
+from utils import tracing
 from cogs.scheduler_cog import SchedulerCog
 from cogs.streaks_cog import StreaksCog
 from cogs.admin_cog import AdminCog
@@ -24,21 +31,46 @@ intents.members = True
 # let's move everything into main to be safe.
 
 async def main():
+    restart = False
     try:
-        # Start Webserver Thread
-        webserver.keep_alive()
-
         # Initialize Bot inside the loop
         bot = discord.Bot(intents=intents)
         
         # Initialize Services
         sheets_service = SheetsService()
-        streak_service = StreakService(sheets_service)
+        if config.STREAK_STORE == "sqlite":
+            streak_store = SQLiteStreakStore(config.SQLITE_PATH)
+        else:
+            streak_store = StreakStore()
+        streak_service = StreakService(sheets_service, streak_store)
         crash_logger = CrashLogger(sheets_service)
+        bot.crash_logger = crash_logger
+
+        # Loop lag sampler (+ opt-in slow-callback detector), reporting to the crash log
+        loop_monitor = LoopMonitor(crash_logger)
+        loop_monitor.start()
+
+        # Health server on this loop (a wedged loop can't answer /healthz)
+        health_server = HealthServer(bot, sheets_service, loop_monitor)
+        await health_server.start()
+
+        # One pooled HTTP session for the whole bot (keep-alive to Drive etc.)
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=config.HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=120),
+        )
+        bot.http_session = http_session
+        resolver = Resolver(bot)
+        attachment_cache = AttachmentCache(
+            http_session, config.ATTACHMENT_CACHE_DIR, config.ATTACHMENT_CACHE_MAX_MB * 1024 * 1024
+        )
 
         # Global error handler (needs to be attached to the local 'bot')
         @bot.event
         async def on_application_command_error(ctx, error):
+            trace = getattr(ctx, "trace", None)
+            if trace is not None:
+                tracing.TRACER.mark_failed(trace)
             if isinstance(error, discord.ext.commands.CommandOnCooldown):
                 await ctx.respond(str(error), ephemeral=True)
             elif isinstance(error, discord.ext.commands.MissingRole):
@@ -48,32 +80,50 @@ async def main():
                 await crash_logger.log_crash(error)
                 await ctx.respond("An error occurred.", ephemeral=True)
 
+        # Every slash command is a trace; spans inside it (Sheets calls etc.) attach to it
+        @bot.before_invoke
+        async def start_trace(ctx):
+            # Kept on ctx: the error handler runs after the after-invoke hook, in another task
+            ctx.trace = tracing.begin(f"/{ctx.command.qualified_name}")
+
+        @bot.after_invoke
+        async def end_trace(ctx):
+            tracing.end()
+
         @bot.event
         async def on_ready():
             print(f"Logged in as {bot.user} (ID: {bot.user.id})")
-            
-            # Init sheets connection
+
+            # Normally connected at startup already; retry here if that failed
             await sheets_service.connect()
             if sheets_service.client:
-                print("Sheets service connected.")
+                # Writes a previous run queued but never got to send, and its crash reports
+                await sheets_service.replay_journal()
+                await crash_logger.flush()
             else:
                 print("WARNING: Sheets service FAILED to connect (Check CREDENTIALS_B64).")
 
         # Load Cogs
-        bot.add_cog(SchedulerCog(bot, sheets_service))
+        bot.add_cog(SchedulerCog(bot, sheets_service, attachment_cache, resolver))
         bot.add_cog(StreaksCog(bot, streak_service))
-        bot.add_cog(AdminCog(bot, sheets_service))
+        bot.add_cog(AdminCog(bot, sheets_service, CheckpointStore(config.CHECKPOINT_DIR), resolver))
         
         # Run Bot
         if not config.DISCORD_BOT_TOKEN:
             print("Error: DISCORD_BOT_TOKEN not found.")
             return
 
+        # One authorized Sheets session for the whole process (not per gateway reconnect)
+        await sheets_service.connect()
+        if sheets_service.client:
+            print("Sheets service connected.")
+
         await bot.start(config.DISCORD_BOT_TOKEN)
 
     except Exception as e:
         # General Crash Handling
         print("CRITICAL ERROR IN MAIN LOOP")
+        restart = True
         # Need access to crash_logger if it exists
         try:
             if 'crash_logger' in locals():
@@ -83,7 +133,30 @@ async def main():
         except:
             traceback.print_exc()
 
-        # Restart
+    finally:
+        # Runs on a normal shutdown as well as before a crash restart
+        try:
+            if 'crash_logger' in locals():
+                await asyncio.wait_for(crash_logger.flush(), timeout=10)
+        except Exception:
+            traceback.print_exc()
+
+        # Push out queued Sheets writes and stop the Sheets pool
+        # (anything left is in the journal)
+        try:
+            if 'sheets_service' in locals():
+                await sheets_service.close(timeout=10)
+        except Exception:
+            traceback.print_exc()
+
+        if 'http_session' in locals():
+            await http_session.close()
+        if 'health_server' in locals():
+            await health_server.stop()
+        if 'loop_monitor' in locals():
+            loop_monitor.stop()
+
+    if restart:
         print("Restarting in 5 seconds...")
         time.sleep(5)
         os.execv(sys.executable, ['python'] + sys.argv)
@@ -94,8 +167,8 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         pass
     except Exception as e:
-        # Fallback for asyncio.run failure
-        crash_logger.log_crash_sync(e)
+        # Fallback for asyncio.run failure (uploaded from the spool on the next start)
+        CrashLogger().log_crash_sync(e)
         print("Fatal startup error. Restarting...")
         time.sleep(5)
         os.execv(sys.executable, ['python'] + sys.argv)
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+import aiohttp
+from utils import drive, metrics
+
+class AttachmentCache:
+    """
+    Content-addressed disk cache for scheduled-post attachments.
+
+    Files are keyed by Drive file ID (or a hash of the URL for non-Drive links) and
+    downloaded through the bot's shared aiohttp session. The directory is kept under
+    `max_bytes` by evicting the least recently used files. Concurrent requests for
+    the same file share one download.
+    """
+    def __init__(self, session: aiohttp.ClientSession, cache_dir, max_bytes):
+        self.session = session
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> size, least recently used first
+        self._total = 0
+        self._inflight = {} # key -> Future[(data, filename)]
+        self.hits = 0
+        self.misses = 0
+        metrics.add_collector(self._collect_metrics)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".meta", ".tmp")):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            st = os.stat(path)
+            files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total += size
+
+    def _collect_metrics(self):
+        return [
+            ("attachment_cache_total", "counter", "Attachment lookups by result",
+             [({"result": "hit"}, self.hits), ({"result": "miss"}, self.misses)]),
+            ("attachment_cache_bytes", "gauge", "Bytes on disk in the attachment cache", [({}, self._total)]),
+            ("attachment_cache_files", "gauge", "Files in the attachment cache", [({}, len(self._entries))]),
+        ]
+
+    @staticmethod
+    def cache_key(url):
+        file_id = drive.extract_file_id(url)
+        if file_id:
+            return file_id
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    async def get(self, url):
+        """Returns (bytes, filename) for an attachment URL, or None if it can't be fetched."""
+        if not url:
+            return None
+        key = self.cache_key(url)
+
+        if key in self._entries:
+            try:
+                result = await asyncio.to_thread(self._read, key)
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            except OSError:
+                self._forget(key)
+
+        inflight = self._inflight.get(key)
+        if inflight:
+            return await inflight
+
+        self.misses += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await self._download(key, url)
+            fut.set_result(result)
+            return result
+        except Exception as e:
+            print(f"Attachment download failed for {url}: {e}")
+            fut.set_result(None)
+            return None
+        finally:
+            del self._inflight[key]
+
+    async def prefetch(self, url):
+        """Warms the cache for an upcoming post; errors are swallowed."""
+        if not url or self.cache_key(url) in self._entries:
+            return
+        try:
+            await self.get(url)
+        except Exception:
+            pass
+
+    async def _download(self, key, url):
+        dl_url = drive.convert_drive_url(url)
+        if not dl_url.startswith("http"):
+            return None
+
+        async with self.session.get(dl_url) as resp:
+            if resp.status != 200:
+                print(f"Attachment download returned HTTP {resp.status} for {url}")
+                return None
+            data = await resp.read()
+            filename = self._filename_from(resp.headers.get("Content-Disposition", ""))
+
+        await asyncio.to_thread(self._write, key, data, filename)
+        self._entries[key] = len(data)
+        self._total += len(data)
+        await self._evict()
+        return data, filename
+
+    @staticmethod
+    def _filename_from(disposition):
+        match = re.search(r'filename="?([^";]+)"?', disposition or "")
+        if match:
+            return os.path.basename(match.group(1))
+        return "attachment.png" # Simple default
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _read(self, key):
+        with open(self._path(key), "rb") as f:
+            data = f.read()
+        filename = "attachment.png"
+        try:
+            with open(self._path(key) + ".meta", "r", encoding="utf-8") as f:
+                filename = json.load(f).get("filename", filename)
+        except (OSError, ValueError):
+            pass
+        os.utime(self._path(key)) # mtime doubles as LRU order across restarts
+        return data, filename
+
+    def _write(self, key, data, filename):
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+        with open(self._path(key) + ".meta", "w", encoding="utf-8") as f:
+            json.dump({"filename": filename}, f)
+
+    def _forget(self, key):
+        self._total -= self._entries.pop(key, 0)
+
+    async def _evict(self):
+        victims = []
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            victims.append(key)
+        if victims:
+            await asyncio.to_thread(self._remove, victims)
+
+    def _remove(self, keys):
+        for key in keys:
+            for path in (self._path(key), self._path(key) + ".meta"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
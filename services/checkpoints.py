@@ -0,0 +1,55 @@
+import asyncio
+import json
+import os
+import re
+
+class CheckpointStore:
+    """
+    Small JSON files that let long admin jobs (channel scans, DM runs) pick up where
+    they left off after a crash or restart. Writes are atomic (temp file + rename)
+    and run off the event loop.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, name):
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        return os.path.join(self.directory, f"{safe}.json")
+
+    async def load(self, name):
+        """Returns the saved dict, or None if there is no (readable) checkpoint."""
+        def _load():
+            try:
+                with open(self._path(name), "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return None
+        return await asyncio.to_thread(_load)
+
+    async def save(self, name, data):
+        path = self._path(name)
+        payload = json.dumps(data)
+
+        def _save():
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        await asyncio.to_thread(_save)
+
+    async def delete(self, name):
+        def _delete():
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+        await asyncio.to_thread(_delete)
+
+    def names(self, prefix=""):
+        """Names of stored checkpoints starting with `prefix`."""
+        try:
+            files = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [f[:-5] for f in files if f.endswith(".json") and f.startswith(prefix)]
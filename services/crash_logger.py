@@ -1,53 +1,281 @@
 import os
+import re
+import json
+import time
+import hashlib
 import traceback
+from collections import deque
 from datetime import datetime
 import asyncio
-from services.sheets_service import SheetsService
+import config
+from services.sheets_service import SheetsService, PRIORITY_WRITE
+from utils import metrics
+
+CRASH_REPORTS = metrics.counter(
+    "crash_reports_total", "Crash reports by what happened to them", ("outcome",)
+)
+
+# Masked before fingerprinting, so the same failure with other IDs/line numbers matches
+_VOLATILE = re.compile(r"0x[0-9a-fA-F]+|\d+")
+MAX_CELL_CHARS = 45000 # Sheets allows 50k per cell
+BATCH_MAX = 100
 
 class CrashLogger:
+    """
+    Crash and problem reports, written to crash.log and the CrashLogs tab.
+
+    log_crash() / log_report() only build the report and put it on a bounded queue
+    (CRASH_QUEUE_SIZE); a background worker handles it in batches:
+    - reports with the same fingerprint within CRASH_DEDUP_WINDOW seconds are
+      collapsed: the first one is written, the repeats become one row with a count,
+    - at most CRASH_MAX_PER_MINUTE reports are written per minute, the rest are
+      counted in a "suppressed" row,
+    - file writes run in a thread and each batch is a single append_rows call.
+
+    Written reports are also spooled (one JSON line each) until the sheet has them.
+    log_crash_sync() writes the same crash.log entry and spool line, so reports from
+    a fatal crash are uploaded by the next process (see flush()).
+    """
     def __init__(self, sheets_service: SheetsService = None):
         self.sheets_service = sheets_service
         self.log_file = "crash.log"
+        self.spool_file = config.CRASH_SPOOL_PATH
+        self._queue = asyncio.Queue(maxsize=config.CRASH_QUEUE_SIZE)
+        self._worker = None
+        self._lock = asyncio.Lock()
+        self._seen = {} # fingerprint -> {"first", "count", "report", "last_ts"}
+        self._written = deque() # monotonic times of the reports written in the last minute
+        self._suppressed = 0
+        self._unsent = [] # rows written locally but not yet in the sheet
+        self._spool_loaded = False
+        self.dropped = 0
+
+    # --- building reports -------------------------------------------------
+
+    @staticmethod
+    def _fingerprint(summary, details):
+        return hashlib.sha1(_VOLATILE.sub("#", f"{summary}\n{details}").encode("utf-8")).hexdigest()[:12]
+
+    @classmethod
+    def _crash_report(cls, exc):
+        # format_exc() only works inside the except block; the exception carries its own traceback
+        details = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        return {
+            "ts": datetime.now().isoformat(),
+            "kind": "CRASH",
+            "summary": str(exc),
+            "details": details,
+            "fp": cls._fingerprint(type(exc).__name__, details),
+        }
+
+    @classmethod
+    def _report(cls, title, details):
+        return {
+            "ts": datetime.now().isoformat(),
+            "kind": "REPORT",
+            "summary": title,
+            "details": details,
+            "fp": cls._fingerprint(title, details),
+        }
+
+    # --- entry points -----------------------------------------------------
 
     def log_crash_sync(self, exc: Exception):
         """
         Synchronous logging for critical failures where loop might be dead.
+        Same crash.log entry and spool line as the async path; the next start uploads it.
         """
-        timestamp = datetime.now().isoformat()
-        tb = traceback.format_exc()
-        entry = f"[{timestamp}] CRASH: {exc}\n{tb}\n{'-'*20}\n"
-        
-        # 1. Local append
-        with open(self.log_file, "a", encoding="utf-8") as f:
-            f.write(entry)
-        
-        # 2. Sheet append (Network might fail, use best effort)
-        # Since we are essentially crashing, we can try to run the async task
-        # via asyncio.run if not in a loop, or just ignore if it's too risky.
-        # But the prompt says "Also append crash logs to a Google Sheet".
-        # If we are inside an exception handler in main (loop running), we can await.
-        pass
+        self._write_local([self._crash_report(exc)])
 
     async def log_crash(self, exc: Exception):
-        timestamp = datetime.now().isoformat()
-        tb = traceback.format_exc()
-        entry = f"[{timestamp}] CRASH: {exc}\n{tb}\n{'-'*20}\n"
-        
-        print(f"LOGGING CRASH: {entry}")
+        """Queues the report and returns at once."""
+        self._enqueue(self._crash_report(exc))
+
+    async def log_report(self, title, details):
+        """Same pipeline as log_crash, for problems that aren't exceptions (e.g. a stalled loop)."""
+        self._enqueue(self._report(title, details))
 
-        # Local File
+    async def flush(self):
+        """
+        Handles everything queued right now (plus the spool left by a previous run)
+        without waiting for the batch timer, and writes out repeat counts and the
+        suppressed count even if their windows are still open, so a restart doesn't
+        lose them. Called after connecting and before a restart.
+        """
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        await self._process(batch, final=True)
+
+    def _enqueue(self, report):
+        try:
+            self._queue.put_nowait(report)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            CRASH_REPORTS.inc(outcome="dropped")
+            return
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+
+    # --- worker -----------------------------------------------------------
+
+    def _idle_timeout(self):
+        """
+        How long the worker may wait for new reports before a repeat count or the
+        suppressed count is due to be written (None: nothing is waiting).
+        """
+        now = time.monotonic()
+        due = [
+            seen["first"] + config.CRASH_DEDUP_WINDOW
+            for seen in self._seen.values() if seen["count"] > 1
+        ]
+        if self._suppressed:
+            due.append(self._written[0] + 60 if self._written else now)
+        if not due:
+            return None
+        return max(0.0, min(due) - now) + 0.01
+
+    async def _run(self):
+        while True:
+            try:
+                first = await asyncio.wait_for(self._queue.get(), self._idle_timeout())
+            except asyncio.TimeoutError:
+                # A burst ended: write out its repeat / suppressed counts
+                try:
+                    await self._process([])
+                except Exception as e:
+                    print(f"Crash logger failed to write repeat counts: {e}")
+                continue
+            batch = [first]
+            deadline = time.monotonic() + config.CRASH_FLUSH_SECONDS
+            while len(batch) < BATCH_MAX:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._process(batch)
+            except Exception as e:
+                print(f"Crash logger failed to process {len(batch)} reports: {e}")
+
+    async def _process(self, batch, final=False):
+        async with self._lock:
+            if not self._spool_loaded:
+                self._spool_loaded = True
+                self._unsent = await asyncio.to_thread(self._read_spool) + self._unsent
+
+            now = time.monotonic()
+            rows = []
+
+            # Dedup windows that ran out: one row for all the repeats
+            for fp, seen in list(self._seen.items()):
+                if now - seen["first"] >= config.CRASH_DEDUP_WINDOW:
+                    if seen["count"] > 1:
+                        rows.append(self._repeat_row(seen))
+                    del self._seen[fp]
+
+            while self._written and now - self._written[0] > 60:
+                self._written.popleft()
+
+            for report in batch:
+                seen = self._seen.get(report["fp"])
+                if seen:
+                    seen["count"] += 1
+                    seen["last_ts"] = report["ts"]
+                    CRASH_REPORTS.inc(outcome="duplicate")
+                    continue
+                if len(self._written) >= config.CRASH_MAX_PER_MINUTE:
+                    self._suppressed += 1
+                    CRASH_REPORTS.inc(outcome="rate_limited")
+                    continue
+                self._written.append(now)
+                self._seen[report["fp"]] = {"first": now, "count": 1, "report": report, "last_ts": report["ts"]}
+                print(f"LOGGING CRASH: [{report['ts']}] {report['summary']}\n{report['details']}")
+                rows.append(report)
+                CRASH_REPORTS.inc(outcome="logged")
+
+            if final:
+                # Open windows too; later repeats are counted from here on
+                for seen in self._seen.values():
+                    if seen["count"] > 1:
+                        rows.append(self._repeat_row(seen))
+                        seen["count"] = 1
+                        seen["since"] = seen["last_ts"]
+
+            if self._suppressed and (final or len(self._written) < config.CRASH_MAX_PER_MINUTE):
+                rows.append({
+                    "ts": datetime.now().isoformat(), "kind": "SUPPRESSED",
+                    "summary": f"{self._suppressed} reports not logged (over {config.CRASH_MAX_PER_MINUTE}/min)",
+                    "details": "", "fp": "",
+                })
+                self._suppressed = 0
+
+            if rows:
+                await asyncio.to_thread(self._write_local, rows)
+                self._unsent.extend(rows)
+            await self._upload()
+
+    @staticmethod
+    def _repeat_row(seen):
+        r = seen["report"]
+        return {
+            "ts": seen["last_ts"], "kind": "REPEAT",
+            "summary": f"(repeated {seen['count'] - 1}x since {seen.get('since', r['ts'])}) {r['summary']}",
+            "details": f"Same fingerprint ({r['fp']}) as the report logged at {r['ts']}.",
+            "fp": r["fp"],
+        }
+
+    async def _upload(self):
+        if not self._unsent or not self.sheets_service or not self.sheets_service.client:
+            return
+        try:
+            ws = await self.sheets_service.get_worksheet("DiscordBot", "CrashLogs") # Default name used
+            if not ws:
+                return
+            rows = list(self._unsent)
+            await self.sheets_service.append_rows(
+                ws, [[r["ts"], r["summary"], r["details"][:MAX_CELL_CHARS]] for r in rows],
+                priority=PRIORITY_WRITE,
+            )
+        except Exception as e:
+            print(f"Failed to log crash to Sheet (kept in {self.spool_file}): {e}")
+            return
+        del self._unsent[:len(rows)]
+        if not self._unsent:
+            await asyncio.to_thread(self._clear_spool)
+
+    # --- disk (blocking; worker thread, or the dying process) -------------
+
+    def _write_local(self, rows):
         try:
             with open(self.log_file, "a", encoding="utf-8") as f:
-                f.write(entry)
+                for r in rows:
+                    f.write(f"[{r['ts']}] {r['kind']}: {r['summary']}\n{r['details']}\n{'-'*20}\n")
+            with open(self.spool_file, "a", encoding="utf-8") as f:
+                for r in rows:
+                    f.write(json.dumps(r) + "\n")
         except Exception as e:
             print(f"Failed to write to crash.log: {e}")
 
-        # Google Sheet
-        if self.sheets_service:
-            try:
-                ws = await self.sheets_service.get_worksheet("DiscordBot", "CrashLogs") # Default name used
-                if ws:
-                    await self.sheets_service.append_row(ws, [timestamp, str(exc), tb])
-            except Exception as e:
-                print(f"Failed to log crash to Sheet: {e}")
+    def _read_spool(self):
+        if not os.path.exists(self.spool_file):
+            return []
+        rows = []
+        with open(self.spool_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue # torn last line
+        if rows:
+            print(f"Uploading {len(rows)} crash reports left by a previous run")
+        return rows
 
+    def _clear_spool(self):
+        try:
+            os.remove(self.spool_file)
+        except FileNotFoundError:
+            pass
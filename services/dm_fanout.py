@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import time
+import discord
+import config
+from services.checkpoints import CheckpointStore
+from services.resolver import Resolver
+from utils import metrics
+from utils.rate_limit import TokenBucket, AdaptiveRate
+
+DM_MESSAGES = metrics.counter("dm_messages_total", "DM fan-out sends, by outcome", ("outcome",))
+DM_RATE = metrics.gauge("dm_rate_per_second", "Current adaptive DM send rate")
+
+class DMFanout:
+    """
+    Sends one message to many users as fast as Discord allows.
+
+    Users are resolved concurrently, sends go through a token bucket whose rate adapts
+    (AIMD), and every outcome is checkpointed per target (keyed by the message text)
+    while the run is in progress. A run that finishes (every target attempted) drops
+    its checkpoint, so sending the same text later is a new campaign; only a run that
+    was interrupted (crash, restart, cancel) is resumed, skipping everyone it reached.
+
+    py-cord handles 429s itself (sleeps and retries inside send()), so the rate limit
+    is seen as send latency: a send far slower than the running average, or a 429
+    that survived py-cord's retries, halves the rate; steady successes raise it again.
+    """
+    def __init__(self, resolver: Resolver, checkpoints: CheckpointStore):
+        self.resolver = resolver
+        self.checkpoints = checkpoints
+        self.bucket = TokenBucket(config.DM_RATE_PER_SEC, config.DM_BURST)
+        self.rate = AdaptiveRate(self.bucket, config.DM_MIN_RATE_PER_SEC, config.DM_MAX_RATE_PER_SEC)
+        self.avg_send = None # EWMA of send() duration, seconds
+        self._last_throttle = 0.0
+
+    def _throttled(self):
+        # Concurrent workers hit by the same limit should halve the rate once, not N times
+        now = time.monotonic()
+        if now - self._last_throttle >= config.DM_THROTTLE_COOLDOWN:
+            self._last_throttle = now
+            self.rate.throttled()
+        DM_MESSAGES.inc(outcome="throttled")
+        DM_RATE.set(self.bucket.rate)
+
+    def _record_send(self, seconds):
+        """Feeds the AIMD controller from how long a successful send took."""
+        slow = self.avg_send is not None and seconds >= max(
+            config.DM_SLOW_SEND_SECONDS, self.avg_send * config.DM_SLOW_SEND_FACTOR
+        )
+        if slow:
+            self._throttled() # py-cord waited out a rate limit inside send()
+        else:
+            self.avg_send = seconds if self.avg_send is None else 0.8 * self.avg_send + 0.2 * seconds
+            self.rate.success()
+        DM_RATE.set(self.bucket.rate)
+
+    @staticmethod
+    def _checkpoint_name(message):
+        return "dm_" + hashlib.sha1(message.encode("utf-8")).hexdigest()[:16]
+
+    async def _resolve(self, uid):
+        user = await self.resolver.get_user(uid)
+        if user is None:
+            raise LookupError("user not found")
+        return user
+
+    async def interrupted(self, message):
+        """Users an interrupted earlier run of this message already reached (0 if none)."""
+        state = await self.checkpoints.load(self._checkpoint_name(message))
+        return len(state["sent"]) if state else 0
+
+    async def run(self, targets, message, progress=None):
+        """
+        targets: list of user ID strings. progress(sent, failed, total) is awaited every
+        DM_PROGRESS_SECONDS. Returns (sent_count, failed_ids); sent_count includes users
+        skipped because an interrupted earlier run of the same message reached them.
+        """
+        name = self._checkpoint_name(message)
+        state = await self.checkpoints.load(name) or {"sent": [], "failed": {}}
+        sent = set(state["sent"])
+        failed = {} # retried on a new run, so only this run's failures are reported
+
+        # De-duplicate while keeping sheet order
+        target_set = set(targets)
+        pending = [uid for uid in dict.fromkeys(targets) if uid and uid not in sent]
+        total = len(pending) + len(sent & target_set)
+        queue = asyncio.Queue()
+        for uid in pending:
+            queue.put_nowait(uid)
+
+        dirty = False
+        last_save = time.monotonic()
+
+        async def _checkpoint(force=False):
+            nonlocal dirty, last_save
+            if dirty and (force or time.monotonic() - last_save >= 5):
+                state["sent"] = list(sent)
+                state["failed"] = failed
+                await self.checkpoints.save(name, state)
+                dirty = False
+                last_save = time.monotonic()
+
+        async def _worker():
+            nonlocal dirty
+            while True:
+                try:
+                    uid = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    user = await self._resolve(uid)
+                except Exception as e:
+                    failed[uid] = f"lookup: {e}"
+                    dirty = True
+                    continue
+
+                for attempt in range(config.DM_MAX_ATTEMPTS):
+                    await self.bucket.acquire()
+                    try:
+                        started = time.monotonic()
+                        await user.send(message)
+                        self._record_send(time.monotonic() - started)
+                        sent.add(uid)
+                        failed.pop(uid, None)
+                        DM_MESSAGES.inc(outcome="sent")
+                        break
+                    except discord.Forbidden as e:
+                        failed[uid] = f"forbidden: {e}" # DMs closed, retrying won't help
+                        break
+                    except discord.HTTPException as e:
+                        if e.status == 429:
+                            # Still limited after py-cord's own retries: back off hard
+                            self._throttled()
+                            await asyncio.sleep(config.DM_THROTTLE_BACKOFF)
+                            continue
+                        failed[uid] = str(e)
+                        if e.status < 500:
+                            break
+                    except Exception as e:
+                        failed[uid] = str(e)
+                        break
+                else:
+                    failed.setdefault(uid, "gave up after repeated rate limits / server errors")
+                if uid in failed:
+                    DM_MESSAGES.inc(outcome="failed")
+                dirty = True
+                await _checkpoint()
+
+        async def _reporter():
+            while True:
+                await asyncio.sleep(config.DM_PROGRESS_SECONDS)
+                try:
+                    await progress(len(sent & target_set), len(failed), total)
+                except Exception:
+                    pass
+
+        reporter = asyncio.ensure_future(_reporter()) if progress else None
+        finished = False
+        try:
+            await asyncio.gather(*[_worker() for _ in range(config.DM_WORKERS)])
+            finished = True
+        finally:
+            if reporter:
+                reporter.cancel()
+            if finished:
+                # Every target attempted: the next run with this text is a new campaign
+                await self.checkpoints.delete(name)
+            else:
+                await _checkpoint(force=True)
+        return len(sent & target_set), list(failed)
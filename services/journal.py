@@ -0,0 +1,123 @@
+import json
+import os
+
+class WriteJournal:
+    """
+    Append-only journal of outbound Sheets mutations.
+
+    Each queued write is recorded (one JSON line) before it is handed to the write
+    queue and acknowledged once its batch has been written. Whatever is still
+    unacknowledged when the process dies is replayed on the next start, which makes
+    write-behind batching safe across crashes and os.execv restarts. Delivery is
+    at-least-once: an append that succeeded right before a crash may be sent twice.
+
+    Lines: {"op": "put", "id": n, "tab": ..., "kind": "cell"|"row", "priority": ..., ...} and
+           {"op": "ack", "ids": [...]}
+    """
+    def __init__(self, path, fsync=False, compact_bytes=1024 * 1024):
+        self.path = path
+        self.fsync = fsync
+        # Compaction rewrites the file on the loop, so it only happens once the file
+        # has grown past this many bytes (and to twice what the last compaction kept,
+        # so a large backlog of unacknowledged entries isn't rewritten on every ack)
+        self.compact_bytes = compact_bytes
+        self._compacted_size = 0
+        self._pending = {} # id -> entry
+        self._next_id = 1
+        self._load()
+        self._fh = open(self.path, "a", encoding="utf-8")
+        self._size = self._fh.tell()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue # torn last line from a crash
+                if rec.get("op") == "put":
+                    self._pending[rec["id"]] = rec
+                    self._next_id = max(self._next_id, rec["id"] + 1)
+                elif rec.get("op") == "ack":
+                    for i in rec["ids"]:
+                        self._pending.pop(i, None)
+
+    def _write(self, rec):
+        line = json.dumps(rec) + "\n"
+        self._fh.write(line)
+        self._size += len(line)
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+
+    def record_cell(self, tab, row, col, value, priority=None):
+        return self._record({"tab": tab, "kind": "cell", "row": row, "col": col, "value": value, "priority": priority})
+
+    def record_row(self, tab, data, priority=None):
+        return self._record({"tab": tab, "kind": "row", "data": data, "priority": priority})
+
+    def _record(self, entry):
+        entry = dict(entry, op="put", id=self._next_id)
+        self._next_id += 1
+        self._write(entry)
+        self._pending[entry["id"]] = entry
+        return entry["id"]
+
+    def ack(self, ids):
+        ids = [i for i in ids if i in self._pending]
+        if not ids:
+            return
+        # Older unacknowledged writes to a cell that was just written are obsolete too
+        written = {}
+        for i in ids:
+            e = self._pending[i]
+            if e["kind"] == "cell":
+                key = (e["tab"], e["row"], e["col"])
+                written[key] = max(written.get(key, 0), i)
+        if written:
+            acked = set(ids)
+            ids += [
+                i for i, e in self._pending.items()
+                if e["kind"] == "cell" and i not in acked
+                and i < written.get((e["tab"], e["row"], e["col"]), 0)
+            ]
+        self._write({"op": "ack", "ids": ids})
+        for i in ids:
+            del self._pending[i]
+        if self._size >= max(self.compact_bytes, 2 * self._compacted_size):
+            self.compact()
+
+    def pending(self):
+        """
+        Unacknowledged entries in write order. A cell write superseded by a later write
+        to the same cell is left out (and acknowledged), so replay never rolls a cell back.
+        """
+        latest = {}
+        for i, e in self._pending.items():
+            if e["kind"] == "cell":
+                latest[(e["tab"], e["row"], e["col"])] = i
+        keep, stale = [], []
+        for i in sorted(self._pending):
+            e = self._pending[i]
+            if e["kind"] == "cell" and latest[(e["tab"], e["row"], e["col"])] != i:
+                stale.append(i)
+            else:
+                keep.append(e)
+        self.ack(stale)
+        return keep
+
+    def compact(self):
+        """Rewrites the file with only the unacknowledged entries."""
+        self._fh.close()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for i in sorted(self._pending):
+                f.write(json.dumps(self._pending[i]) + "\n")
+        os.replace(tmp, self.path)
+        self._fh = open(self.path, "a", encoding="utf-8")
+        self._size = self._compacted_size = self._fh.tell()
+
+    def close(self):
+        self._fh.close()
@@ -0,0 +1,74 @@
+from bisect import bisect_left, insort
+
+class Leaderboard:
+    """
+    Streak leaderboard kept in sorted order as streaks change.
+
+    Entries are stored as (-streak, user_id) in a sorted list, so top-N is a slice
+    and a user's rank is a binary search. `top_version` changes whenever the top
+    `top_n` entries change, which lets callers cache the rendered leaderboard.
+    """
+    def __init__(self, top_n=10):
+        self.top_n = top_n
+        self.top_version = 0
+        self._keys = [] # sorted [(-streak, user_id)]
+        self._streaks = {} # user_id -> streak
+        self._names = {} # user_id -> username
+
+    def __len__(self):
+        return len(self._keys)
+
+    def rebuild(self, entries):
+        """entries: iterable of (user_id, username, streak)."""
+        self._streaks = {}
+        self._names = {}
+        for uid, username, streak in entries:
+            self._streaks[uid] = streak
+            self._names[uid] = username
+        self._keys = sorted((-s, uid) for uid, s in self._streaks.items())
+        self.top_version += 1
+
+    def update(self, user_id, username, streak):
+        old = self._streaks.get(user_id)
+        if old == streak and self._names.get(user_id) == username:
+            return
+
+        in_top = False
+        if old is not None:
+            key = (-old, user_id)
+            pos = bisect_left(self._keys, key)
+            in_top = pos < self.top_n
+            if old != streak:
+                del self._keys[pos]
+
+        if old is None or old != streak:
+            key = (-streak, user_id)
+            insort(self._keys, key)
+            in_top = in_top or bisect_left(self._keys, key) < self.top_n
+
+        self._streaks[user_id] = streak
+        self._names[user_id] = username
+        if in_top:
+            self.top_version += 1
+
+    def remove(self, user_id):
+        old = self._streaks.pop(user_id, None)
+        self._names.pop(user_id, None)
+        if old is None:
+            return
+        pos = bisect_left(self._keys, (-old, user_id))
+        del self._keys[pos]
+        if pos < self.top_n:
+            self.top_version += 1
+
+    def top(self, limit=10):
+        """Returns [(user_id, username, streak)] best first."""
+        return [(uid, self._names.get(uid, "Unknown"), -neg) for neg, uid in self._keys[:limit]]
+
+    def rank(self, user_id):
+        """1-based rank of a user, or None if they are not on the board."""
+        streak = self._streaks.get(user_id)
+        if streak is None:
+            return None
+        # Users tied on streak share the rank of the first of them
+        return bisect_left(self._keys, (-streak, "")) + 1
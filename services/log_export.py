@@ -0,0 +1,155 @@
+import asyncio
+import csv
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import zlib
+import openpyxl
+import config
+from utils import metrics
+
+FORMATS = ("xlsx", "csv", "csv.gz")
+
+EXPORT_ROWS = metrics.counter("export_rows_total", "Rows exported, by format", ("format",))
+EXPORT_BYTES = metrics.counter("export_bytes_total", "Bytes of finished export files, by format", ("format",))
+
+GZIP_TRAILER_BYTES = 64 # final deflate block + gzip trailer written on close
+
+def upload_limit(guild=None):
+    """Part size for a destination: the guild's attachment limit, or the DM default (guild=None)."""
+    limit = guild.filesize_limit if guild is not None else config.DM_FILESIZE_LIMIT
+    return max(1024 * 1024, limit - config.EXPORT_SIZE_MARGIN)
+
+class StreamingExport:
+    """
+    Writes exported rows straight to temp files instead of building a workbook in memory.
+
+    Rows are handed over in chunks and written in a worker thread (openpyxl write-only
+    mode, or csv / gzipped csv), so the event loop never runs the serializer and memory
+    stays at about two chunks however long the export is. Output is split into parts
+    that stay under `max_part_bytes` so each one fits in a Discord attachment.
+    """
+    def __init__(self, fmt, base_name, header, max_part_bytes):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}'")
+        self.fmt = fmt
+        self.base_name = base_name
+        self.header = header
+        self.max_part_bytes = max_part_bytes
+        self.rows_written = 0
+        self.paths = []
+
+        self._dir = tempfile.mkdtemp(prefix="export_")
+        self._pending = None # write of the previous chunk, still running in its thread
+
+        # Current part (only touched from the worker thread)
+        self._wb = None
+        self._ws = None
+        self._fh = None
+        self._raw = None
+        self._csv = None
+        self._part_bytes = 0
+        self._header_bytes = 0
+        self._gz = None
+        self._unflushed = 0 # csv.gz: text bytes written since the last sync flush
+
+    async def write_rows(self, rows):
+        """Queues a chunk; waits only for the previous chunk, so reading and writing overlap."""
+        if self._pending:
+            await self._pending
+        self._pending = asyncio.ensure_future(asyncio.to_thread(self._write_chunk, rows))
+        EXPORT_ROWS.inc(len(rows), format=self.fmt)
+
+    async def finish(self):
+        """Flushes and closes the last part. Returns the list of file paths."""
+        if self._pending:
+            await self._pending
+            self._pending = None
+        await asyncio.to_thread(self._close_part)
+        if not self.paths:
+            # Empty export still produces a file with the header
+            await asyncio.to_thread(self._write_chunk, [])
+            await asyncio.to_thread(self._close_part)
+        EXPORT_BYTES.inc(sum(os.path.getsize(p) for p in self.paths), format=self.fmt)
+        if len(self.paths) == 1:
+            single = os.path.join(self._dir, f"{self.base_name}.{self.fmt}")
+            os.replace(self.paths[0], single)
+            self.paths = [single]
+        return list(self.paths)
+
+    def cleanup(self):
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def _write_chunk(self, rows):
+        if self._wb is None and self._fh is None:
+            self._open_part()
+        for row in rows:
+            # xlsx size is only known on save, so go by the raw text size (the zip only shrinks it)
+            size = self._row_size(row)
+            if self._part_bytes > self._header_bytes and self._part_size(size) > self.max_part_bytes:
+                self._close_part()
+                self._open_part()
+            if self.fmt == "xlsx":
+                self._ws.append(row)
+            else:
+                self._csv.writerow(row)
+            self._part_bytes += size
+            self._unflushed += size
+            self.rows_written += 1
+
+    @staticmethod
+    def _row_size(row):
+        # encoded text + separators / line ending (csv quoting aside)
+        return sum(len(str(v).encode("utf-8")) for v in row) + len(row) + 1
+
+    def _part_size(self, next_row_size):
+        if self.fmt == "csv.gz":
+            # File size so far plus everything still inside the compressor, counted
+            # uncompressed (the worst case). Only when that looks too big is the
+            # compressor flushed to get the exact figure, so this costs a handful of
+            # sync flushes per part rather than one per row.
+            estimate = self._raw.tell() + self._unflushed + next_row_size + GZIP_TRAILER_BYTES
+            if estimate > self.max_part_bytes and self._unflushed:
+                self._fh.flush()
+                self._gz.flush(zlib.Z_SYNC_FLUSH)
+                self._unflushed = 0
+                estimate = self._raw.tell() + next_row_size + GZIP_TRAILER_BYTES
+            return estimate
+        return self._part_bytes + next_row_size
+
+    def _open_part(self):
+        part = len(self.paths) + 1
+        path = os.path.join(self._dir, f"{self.base_name}_part{part}.{self.fmt}")
+        self.paths.append(path)
+        self._part_bytes = self._header_bytes = self._row_size(self.header)
+        if self.fmt == "xlsx":
+            self._wb = openpyxl.Workbook(write_only=True)
+            self._ws = self._wb.create_sheet()
+            self._ws.append(self.header)
+            self._wb_path = path
+        else:
+            if self.fmt == "csv.gz":
+                self._raw = open(path, "wb")
+                self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb")
+                self._fh = io.TextIOWrapper(self._gz, encoding="utf-8", newline="")
+                self._unflushed = self._header_bytes
+            else:
+                self._fh = open(path, "w", encoding="utf-8", newline="")
+            self._csv = csv.writer(self._fh)
+            self._csv.writerow(self.header)
+
+    def _close_part(self):
+        if self._wb is not None:
+            self._wb.save(self._wb_path)
+            self._wb = None
+            self._ws = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+            self._csv = None
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+            self._gz = None
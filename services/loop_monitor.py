@@ -0,0 +1,132 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+import config
+from utils import metrics
+
+LOOP_LAG = metrics.histogram(
+    "loop_lag_seconds", "How late the loop monitor's periodic tick ran",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+SLOW_CALLBACKS = metrics.counter("loop_slow_callbacks_total", "Stalls caught by the slow-callback detector")
+LOOP_REPORTS = metrics.counter("loop_stall_reports_total", "Loop stalls reported to the crash log, by outcome", ("outcome",))
+
+MAX_SAMPLES = 5 # stack samples kept per stall
+
+class LoopMonitor:
+    """
+    Watches the event loop for blocking work.
+
+    Lag sampler (always on): a callback re-arms itself every LOOP_MONITOR_INTERVAL
+    and records how late it ran. Lag above LOOP_LAG_REPORT_SECONDS is reported to
+    the crash log (at most once per LOOP_REPORT_COOLDOWN).
+
+    Slow-callback detector (opt-in, SLOW_CALLBACK_DETECTOR=1): a watchdog thread
+    notices when the tick is overdue by more than SLOW_CALLBACK_SECONDS and samples
+    the loop thread's stack while it is still blocked, so the report shows what
+    was running. Costs one sleeping thread and a few cheap callbacks per second.
+    """
+    def __init__(self, crash_logger=None):
+        self.crash_logger = crash_logger
+        self.detector = config.SLOW_CALLBACK_DETECTOR
+        self.threshold = config.SLOW_CALLBACK_SECONDS
+        # The tick has to come round faster than the threshold to catch a stall
+        self.interval = min(config.LOOP_MONITOR_INTERVAL, self.threshold / 2) if self.detector else config.LOOP_MONITOR_INTERVAL
+        self.loop = None
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.last_tick = time.monotonic()
+        self.slow_callbacks = 0
+        self._expected = None
+        self._handle = None
+        self._loop_thread = None
+        self._lock = threading.Lock()
+        self._samples = []
+        self._stopping = threading.Event()
+        self._last_report = 0.0
+        metrics.add_collector(self._collect_metrics)
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self._expected = self.last_tick + self.interval
+        self._handle = self.loop.call_later(self.interval, self._tick)
+        if self.detector:
+            threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+            print(f"Slow-callback detector on (threshold {self.threshold}s)")
+
+    def stop(self):
+        self._stopping.set()
+        if self._handle:
+            self._handle.cancel()
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = max(0.0, now - self._expected)
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.last_tick = now
+        LOOP_LAG.observe(lag)
+
+        with self._lock:
+            samples, self._samples = self._samples, []
+        if samples:
+            self.slow_callbacks += 1
+            SLOW_CALLBACKS.inc()
+            self._report(lag, samples)
+        elif lag >= config.LOOP_LAG_REPORT_SECONDS:
+            self._report(lag, None)
+
+        self._expected = now + self.interval
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+    def _watch(self):
+        # Runs in its own thread; only reads last_tick and the loop thread's frame
+        poll = max(0.01, self.threshold / 4)
+        while not self._stopping.wait(poll):
+            if time.monotonic() - self.last_tick < self.threshold + self.interval:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame))
+            with self._lock:
+                if len(self._samples) < MAX_SAMPLES:
+                    self._samples.append(stack)
+
+    def _report(self, lag, samples):
+        now = time.monotonic()
+        if now - self._last_report < config.LOOP_REPORT_COOLDOWN:
+            LOOP_REPORTS.inc(outcome="suppressed")
+            return
+        self._last_report = now
+        LOOP_REPORTS.inc(outcome="reported")
+
+        title = f"Event loop blocked for {lag:.2f}s"
+        if samples:
+            # A long stall is usually sampled in the same place several times
+            distinct = list(dict.fromkeys(samples))
+            details = f"{len(samples)} stack sample(s) taken while blocked:\n\n" + "\n---\n".join(distinct)
+        else:
+            details = "No stack sample (slow-callback detector is off, set SLOW_CALLBACK_DETECTOR=1)."
+        print(title)
+        if self.crash_logger:
+            asyncio.ensure_future(self.crash_logger.log_report(title, details))
+
+    def _collect_metrics(self):
+        return [
+            ("loop_lag_last_seconds", "gauge", "Lag of the latest loop monitor tick", [({}, self.lag)]),
+            ("loop_lag_max_seconds", "gauge", "Worst loop lag since start", [({}, self.max_lag)]),
+        ]
+
+    def stats(self):
+        return {
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "since_tick": time.monotonic() - self.last_tick,
+            "slow_callbacks": self.slow_callbacks,
+            "detector": self.detector,
+        }
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from collections import OrderedDict
+import discord
+import config
+from utils import metrics
+
+_NOT_FOUND = object()
+
+class Resolver:
+    """
+    Shared user/channel lookup for the cogs, used instead of calling bot.fetch_* directly.
+
+    Order: the gateway cache (bot.get_*), then a bounded LRU with TTL, then one REST
+    fetch. IDs that come back as not found are cached too (for a shorter TTL), and
+    concurrent lookups of the same ID share a single request.
+    """
+    def __init__(self, bot, maxsize=None, ttl=None, negative_ttl=None):
+        self.bot = bot
+        self.maxsize = maxsize or config.RESOLVER_CACHE_SIZE
+        self.ttl = ttl or config.RESOLVER_TTL
+        self.negative_ttl = negative_ttl or config.RESOLVER_NEGATIVE_TTL
+        self._cache = OrderedDict() # (kind, id) -> (value or _NOT_FOUND, expires_at)
+        self._inflight = {} # (kind, id) -> Future
+        self.stats = {
+            "user": {"gateway": 0, "hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0},
+            "channel": {"gateway": 0, "hits": 0, "negative_hits": 0, "misses": 0, "coalesced": 0},
+        }
+        metrics.add_collector(self._collect_metrics)
+
+    async def get_user(self, user_id):
+        """Returns the User, or None if it does not exist."""
+        return await self._resolve("user", int(user_id), self.bot.get_user, self.bot.fetch_user)
+
+    async def get_channel(self, channel_id):
+        """Returns the channel, or None if it does not exist / is not visible to the bot."""
+        return await self._resolve("channel", int(channel_id), self.bot.get_channel, self.bot.fetch_channel)
+
+    def hit_rates(self):
+        rates = {}
+        for kind, s in self.stats.items():
+            total = s["gateway"] + s["hits"] + s["negative_hits"] + s["misses"] + s["coalesced"]
+            rates[kind] = ((total - s["misses"]) / total) if total else 0.0
+        return rates
+
+    def _collect_metrics(self):
+        return [
+            ("resolver_lookups_total", "counter", "User/channel lookups by kind and where they were answered",
+             [({"kind": kind, "result": result}, n) for kind, s in self.stats.items() for result, n in s.items()]),
+            ("resolver_cache_entries", "gauge", "Entries in the resolver LRU", [({}, len(self._cache))]),
+        ]
+
+    async def _resolve(self, kind, obj_id, local, fetch):
+        stats = self.stats[kind]
+        obj = local(obj_id)
+        if obj is not None:
+            stats["gateway"] += 1
+            return obj
+
+        key = (kind, obj_id)
+        cached = self._cache.get(key)
+        if cached:
+            value, expires_at = cached
+            if expires_at > time.monotonic():
+                self._cache.move_to_end(key)
+                if value is _NOT_FOUND:
+                    stats["negative_hits"] += 1
+                    return None
+                stats["hits"] += 1
+                return value
+            del self._cache[key]
+
+        inflight = self._inflight.get(key)
+        if inflight:
+            stats["coalesced"] += 1
+            return await asyncio.shield(inflight)
+
+        stats["misses"] += 1
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            try:
+                value = await fetch(obj_id)
+                self._store(key, value, self.ttl)
+            except (discord.NotFound, discord.Forbidden):
+                value = None
+                self._store(key, _NOT_FOUND, self.negative_ttl)
+            fut.set_result(value)
+            return value
+        except Exception as e:
+            # Transient errors are not cached; waiters see the same error
+            fut.set_exception(e)
+            fut.exception() # mark retrieved in case nobody else was waiting
+            raise
+        except BaseException:
+            # Fetching task was cancelled: don't leave coalesced waiters hanging
+            fut.cancel()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _store(self, key, value, ttl):
+        self._cache[key] = (value, time.monotonic() + ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
@@ -0,0 +1,122 @@
+import heapq
+from datetime import timedelta
+from utils import time_utils
+
+# Schedule columns: A=Content(0), B=Date(1), C=Time(2), D=Sent(3), E=Attach(4), F=ChannelID(5), G=Mentions(6), H=Reactions(7)
+
+class ScheduleEngine:
+    """
+    Min-heap of pending Schedule rows ordered by fire time.
+
+    `load()` rebuilds the heap from a full sheet read, `apply_changes()` re-parses
+    just the rows a conditional read reported as changed, `pop_due()` hands out rows
+    whose time has come. Rows that fell due while the bot was down are still
+    returned as long as they are within `catchup` of now; older ones are reported
+    and dropped. Rows already handed out are remembered so a refresh that races the
+    Sent=TRUE write does not post them twice; that memory is dropped once no unsent
+    row carries the key any more (marked Sent=TRUE or deleted).
+    """
+    def __init__(self, catchup_minutes=720):
+        self.catchup = timedelta(minutes=catchup_minutes)
+        self._heap = [] # [(fire_at, row_idx, post)]
+        self._posts = {} # row_idx -> post, for the pending rows in the heap
+        self._unsent = {} # row_idx -> post key, for every unsent row (handed out or not)
+        self._dispatched = set() # post keys already sent (or being sent)
+        self._skipped = set() # post keys too old to catch up, already reported
+
+    def __len__(self):
+        return len(self._heap)
+
+    @staticmethod
+    def _key(post):
+        return (post["date"], post["time"], post["channel_id"], post["content"])
+
+    def load(self, rows):
+        """rows: get_all_values() of the Schedule tab, header included. Returns pending count."""
+        self._posts = {}
+        self._unsent = {}
+        return self.apply_changes(list(enumerate(rows, start=1)), [])
+
+    def apply_changes(self, updated, removed):
+        """
+        Re-parses only the given rows. updated: [(row_idx, row)], removed: [row_idx]
+        (the shape returned by SheetsService.get_values_if_changed). Returns pending count.
+        """
+        for row_idx in removed:
+            self._posts.pop(row_idx, None)
+            self._unsent.pop(row_idx, None)
+        for row_idx, row in updated:
+            post = self._parse_row(row_idx, row)
+            if post is None:
+                self._posts.pop(row_idx, None)
+                self._unsent.pop(row_idx, None)
+                continue
+            key = self._key(post)
+            self._unsent[row_idx] = key
+            if key in self._dispatched:
+                self._posts.pop(row_idx, None)
+            else:
+                self._posts[row_idx] = post
+        self._forget_gone()
+
+        heap = [(p["fire_at"], row_idx, p) for row_idx, p in self._posts.items()]
+        heapq.heapify(heap)
+        self._heap = heap
+        return len(heap)
+
+    def _parse_row(self, row_idx, row):
+        if row_idx < 2: # header
+            return None
+
+        # Safe access
+        def get_col(idx):
+            return row[idx] if len(row) > idx else ""
+
+        if get_col(3).upper() == "TRUE":
+            return None
+
+        fire_at = time_utils.parse_sheet_time(get_col(1), get_col(2))
+        if fire_at is None:
+            return None
+
+        post = {
+            "row_idx": row_idx,
+            "fire_at": fire_at,
+            "content": get_col(0),
+            "date": get_col(1),
+            "time": get_col(2),
+            "attach_url": get_col(4),
+            "channel_id": get_col(5),
+            "mentions": get_col(6),
+            "reactions": get_col(7),
+        }
+        return post
+
+    def _forget_gone(self):
+        """Drops handed-out keys no unsent row carries any more, so both sets stay bounded by the sheet."""
+        live = set(self._unsent.values())
+        self._dispatched &= live
+        self._skipped &= live
+
+    def next_fire_time(self):
+        return self._heap[0][0] if self._heap else None
+
+    def upcoming(self, until):
+        """Pending posts due at or before `until` (not popped, any order)."""
+        return [post for fire_at, _, post in self._heap if fire_at <= until]
+
+    def pop_due(self, now):
+        """Pops every post with fire_at <= now. Too-old ones are logged once and discarded."""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, row_idx, post = heapq.heappop(self._heap)
+            self._posts.pop(row_idx, None)
+            key = self._key(post)
+            if now - fire_at > self.catchup:
+                if key not in self._skipped:
+                    self._skipped.add(key)
+                    print(f"Schedule row {row_idx} ({post['date']} {post['time']}) is older than the catch-up window, skipping")
+                continue
+            self._dispatched.add(key)
+            due.append(post)
+        return due
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import metrics
+
+EXECUTOR_WAIT = metrics.histogram(
+    "sheets_executor_wait_seconds", "Time a Sheets call waited for a free worker thread", ("method",)
+)
+
+class SheetsExecutor:
+    """
+    Dedicated thread pool for blocking gspread calls, so a burst of Sheets I/O can't
+    take up the loop's default executor (asyncio.to_thread) that everything else uses.
+
+    Every call is tagged with a kind (e.g. "batch_update", "get_all_values") and
+    timed twice: how long it waited for a free worker and how long it ran.
+    """
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheets")
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._running = 0
+        self._stats = {} # kind -> counters, see _record()
+        self.closed = False
+
+    async def run(self, fn, kind="other"):
+        """Runs blocking `fn` on the pool and returns its result."""
+        if self.closed:
+            raise RuntimeError("Sheets executor is shut down")
+        timing = {}
+        submitted_at = time.perf_counter()
+
+        def _job():
+            started_at = time.perf_counter()
+            timing["wait"] = started_at - submitted_at
+            with self._lock:
+                self._running += 1
+            try:
+                return fn()
+            finally:
+                timing["exec"] = time.perf_counter() - started_at
+                with self._lock:
+                    self._running -= 1
+
+        with self._lock:
+            self._submitted += 1
+        ok = False
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._pool, _job)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                self._submitted -= 1
+            self._record(kind, timing, ok)
+
+    def _record(self, kind, timing, ok):
+        s = self._stats.get(kind)
+        if s is None:
+            s = {"calls": 0, "errors": 0, "wait_total": 0.0, "wait_max": 0.0, "exec_total": 0.0, "exec_max": 0.0}
+            self._stats[kind] = s
+        s["calls"] += 1
+        if not ok:
+            s["errors"] += 1
+        # A call cancelled before it got a worker has no timings
+        wait = timing.get("wait", 0.0)
+        run = timing.get("exec", 0.0)
+        if "wait" in timing:
+            EXECUTOR_WAIT.observe(wait, method=kind)
+        s["wait_total"] += wait
+        s["wait_max"] = max(s["wait_max"], wait)
+        s["exec_total"] += run
+        s["exec_max"] = max(s["exec_max"], run)
+
+    def stats(self):
+        with self._lock:
+            running = self._running
+            queued = self._submitted - running
+        calls = {}
+        for kind, s in self._stats.items():
+            n = s["calls"] or 1
+            calls[kind] = {
+                "calls": s["calls"],
+                "errors": s["errors"],
+                "avg_wait_ms": round(s["wait_total"] / n * 1000, 1),
+                "max_wait_ms": round(s["wait_max"] * 1000, 1),
+                "avg_exec_ms": round(s["exec_total"] / n * 1000, 1),
+                "max_exec_ms": round(s["exec_max"] * 1000, 1),
+            }
+        return {"workers": self.max_workers, "running": running, "queued": max(0, queued), "calls": calls}
+
+    def shutdown(self, wait=False):
+        """
+        Stops accepting work and drops calls that haven't started. Calls already
+        running are left to finish (wait=True blocks until they do).
+        """
+        self.closed = True
+        self._pool.shutdown(wait=wait, cancel_futures=True)
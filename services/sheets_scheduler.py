@@ -0,0 +1,125 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+import gspread
+from utils.rate_limit import TokenBucket
+
+# Priority classes (lower runs first)
+PRIORITY_SCHEDULER = 0 # scheduled posts: reading the Schedule tab, marking rows Sent
+PRIORITY_WRITE = 1 # queued writes (streak mirror, logs, crash logs)
+PRIORITY_NORMAL = 2 # lookups and syncs
+PRIORITY_BULK = 3 # leaderboard refreshes, exports, big appends
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+class SheetsRequestScheduler:
+    """
+    Central gate for every Sheets API call.
+
+    A token bucket sized to the per-minute quota decides when the next call may go;
+    callers waiting for a token are served by priority class (then FIFO). 429 and
+    5xx responses are retried with exponential backoff plus jitter, and a 429 also
+    empties the bucket so everyone slows down together.
+    """
+    def __init__(self, rate_per_minute, burst, max_retries, backoff_base=1.0, backoff_max=64.0):
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._waiters = [] # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failed = 0
+        # Outcome of the latest calls (monotonic), used by /healthz
+        self.last_success = None
+        self.last_failure = None
+        self.last_error = None
+
+    @staticmethod
+    def status_of(exc):
+        if isinstance(exc, gspread.exceptions.APIError):
+            response = getattr(exc, "response", None)
+            return getattr(response, "status_code", None)
+        return None
+
+    @classmethod
+    def is_retryable(cls, exc):
+        return cls.status_of(exc) in RETRYABLE_STATUS
+
+    async def run(self, fn, priority=PRIORITY_NORMAL, execute=None):
+        """
+        Runs blocking `fn` once a token is granted. `execute(fn)` is the awaitable that
+        actually runs it off the loop (defaults to asyncio.to_thread).
+        """
+        execute = execute or asyncio.to_thread
+        attempt = 0
+        while True:
+            await self._acquire(priority)
+            self.requests += 1
+            self.in_flight += 1
+            try:
+                result = await execute(fn)
+                self.last_success = time.monotonic()
+                return result
+            except Exception as e:
+                status = self.status_of(e)
+                if (status is not None and status >= 500) or not isinstance(e, gspread.exceptions.GSpreadException):
+                    # Server side or transport trouble (not e.g. a missing tab)
+                    self.last_failure = time.monotonic()
+                    self.last_error = f"{type(e).__name__}: {e}"[:200]
+                if status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    if status in RETRYABLE_STATUS:
+                        self.failed += 1
+                    raise
+                if status == 429:
+                    self.throttled += 1
+                    self.bucket.drain()
+                self.retries += 1
+                delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+                delay = delay / 2 + random.uniform(0, delay / 2) # jitter
+                attempt += 1
+                print(f"Sheets API {status}, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            finally:
+                self.in_flight -= 1
+            await asyncio.sleep(delay)
+
+    async def _acquire(self, priority):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await fut
+
+    async def _dispatch(self):
+        while self._waiters:
+            await self.bucket.acquire()
+            # Highest priority waiter that is still interested gets the token
+            while self._waiters:
+                _, _, fut = heapq.heappop(self._waiters)
+                if not fut.done():
+                    fut.set_result(None)
+                    break
+            else:
+                self.bucket.refund()
+
+    def stats(self):
+        by_priority = {}
+        for priority, _, fut in self._waiters:
+            if not fut.done():
+                by_priority[priority] = by_priority.get(priority, 0) + 1
+        return {
+            "queued": sum(by_priority.values()),
+            "queued_by_priority": by_priority,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failed": self.failed,
+            "tokens": round(self.bucket.available(), 2),
+        }
@@ -1,4 +1,8 @@
 import gspread
+from gspread.utils import rowcol_to_a1, convert_credentials
+from google.auth.transport.requests import AuthorizedSession, Request
+import requests
+from requests.adapters import HTTPAdapter
 from oauth2client.service_account import ServiceAccountCredentials
 import asyncio
 import json
@@ -6,6 +10,24 @@ import base64
 import config
 from datetime import datetime
 import os
+import time
+import hashlib
+from services.write_queue import WriteQueue
+from services.journal import WriteJournal
+from services.sheets_executor import SheetsExecutor
+from utils import metrics, tracing
+from services.sheets_scheduler import (
+    SheetsRequestScheduler, PRIORITY_SCHEDULER, PRIORITY_WRITE, PRIORITY_NORMAL, PRIORITY_BULK,
+)
+
+SHEETS_REQUESTS = metrics.counter(
+    "sheets_requests_total", "Sheets API calls by method, tab and outcome (each retry counts)",
+    ("method", "tab", "outcome"),
+)
+SHEETS_LATENCY = metrics.histogram(
+    "sheets_request_seconds", "Sheets API call duration including the wait for a worker thread",
+    ("method", "tab"),
+)
 
 class SheetsService:
     def __init__(self):
@@ -15,6 +37,46 @@ class SheetsService:
         ]
         self.creds = self._get_creds()
         self.client = None
+        self.session = None # pooled, authorized HTTP session shared by all gspread calls
+        self._auth = None # google-auth credentials behind self.session
+        # Token grants go through a plain session: refreshing through the authorized
+        # one would send a Bearer header (and refresh it first if already expired)
+        self._token_request = None
+        self._refresh_task = None
+        self.token_refreshes = 0
+
+        # gspread is blocking; its calls run on their own pool, not the default executor
+        self.executor = SheetsExecutor(config.SHEETS_WORKERS)
+
+        # Every API call waits for a token here (quota, priorities, 429/5xx backoff)
+        self.requests = SheetsRequestScheduler(
+            config.SHEETS_RATE_PER_MINUTE, config.SHEETS_BURST, config.SHEETS_MAX_RETRIES
+        )
+
+        # Handle cache: opening a spreadsheet and finding a tab are both API
+        # round trips, so keep the handles around for HANDLE_CACHE_TTL seconds.
+        self._spreadsheets = {} # sheet_name -> (Spreadsheet, expires_at)
+        self._worksheets = {} # (sheet_name, tab_name) -> (Worksheet, expires_at)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # update_cell/append_row go through this so bursts become one API call per tab;
+        # the journal keeps queued writes across crashes/restarts until they are sent
+        self.journal = WriteJournal(
+            config.JOURNAL_PATH, fsync=config.JOURNAL_FSYNC, compact_bytes=config.JOURNAL_COMPACT_BYTES
+        )
+        self.writes = WriteQueue(self._call, journal=self.journal)
+        self._journal_replayed = False
+        # Set once replayed writes are in the sheet; readers whose decisions depend on
+        # them (the first Schedule load) wait for it
+        self.journal_done = asyncio.Event()
+
+        # Last seen contents per tab for get_values_if_changed()
+        self._snapshots = {} # (spreadsheet_id, worksheet_id) -> {"modified", "hash", "rows"}
+        self.unchanged_reads = 0
+        self.changed_reads = 0
+
+        metrics.add_collector(self._collect_metrics)
     
     def _get_creds(self):
         try:
@@ -83,16 +145,52 @@ class SheetsService:
             return None
 
     async def connect(self):
-        """Connects to gspread in a thread."""
-        if not self.creds:
+        """
+        Authorizes once per process (later calls are no-ops). All gspread calls share
+        one keep-alive session with a connection pool sized to the Sheets executor,
+        and the access token is refreshed in the background before it expires, so no
+        request has to wait for a refresh.
+        """
+        if not self.creds or self.client:
             return
-        
+
         def _connect():
-            self.client = gspread.authorize(self.creds)
-        
-        await asyncio.to_thread(_connect)
+            auth = convert_credentials(self.creds)
+            session = AuthorizedSession(auth)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.SHEETS_WORKERS)
+            session.mount("https://", adapter)
+            token_request = Request(requests.Session())
+            auth.refresh(token_request) # first token up front, not on the first read
+            return auth, session, token_request
 
-    async def get_worksheet(self, sheet_name, tab_name):
+        try:
+            self._auth, self.session, self._token_request = await self.executor.run(_connect, "authorize")
+        except Exception as e:
+            print(f"Sheets authorization failed: {e}")
+            return
+        self.client = gspread.Client(auth=self._auth, session=self.session)
+        self._refresh_task = asyncio.ensure_future(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            expiry = self._auth.expiry # naive UTC
+            if expiry is None:
+                delay = 0
+            else:
+                remaining = (expiry - datetime.utcnow()).total_seconds()
+                delay = max(0, remaining - config.SHEETS_TOKEN_REFRESH_MARGIN)
+            await asyncio.sleep(delay)
+            try:
+                await self.executor.run(lambda: self._auth.refresh(self._token_request), "token_refresh")
+                self.token_refreshes += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The session still refreshes on demand if the token does run out
+                print(f"Sheets token refresh failed, retrying in 60s: {e}")
+                await asyncio.sleep(60)
+
+    async def get_worksheet(self, sheet_name, tab_name, priority=PRIORITY_NORMAL):
         """
         Opens a spreadsheet by name and gets the specific tab. 
         Note: The prompt implies one main spreadsheet or using open_by_url? 
@@ -108,17 +206,22 @@ class SheetsService:
         Actually, looking at the previous specific functionality: "CrashLogs sheet (create it with headers if missing)".
         I'll implement a `get_worksheet` that tries to open the spreadsheet (let's call it "DiscordBotData" or configurable).
         I'll add `SHEET_NAME` to config, default "DiscordBot".
+
+        Handles are cached per (spreadsheet, tab) for config.HANDLE_CACHE_TTL seconds,
+        see invalidate() / cache_stats().
         """
+        sheet_name_to_use = getattr(config, "SHEET_NAME", "DiscordBot")
+        key = (sheet_name_to_use, tab_name)
+
+        cached = self._worksheets.get(key)
+        if cached and cached[1] > time.monotonic():
+            self.cache_hits += 1
+            return cached[0]
+        self.cache_misses += 1
+
         def _get():
             try:
-                # Use a default name if not in env, or maybe I should check if there IS an env for it.
-                # The prompt listed SPECIFIC env vars to KEEP. It didn't list SHEET_NAME.
-                # Maybe the previous code had it hardcoded.
-                # I will define `SHEET_NAME` in config as "DiscordBot" or allow override.
-                sheet_name_to_use = getattr(config, "SHEET_NAME", "DiscordBot") 
-                # Or maybe the key is used? 
-                # To be safe, I'll log if I can't find it.
-                sh = self.client.open(sheet_name_to_use)
+                sh = self._open_spreadsheet(sheet_name_to_use)
                 try:
                     return sh.worksheet(tab_name)
                 except gspread.WorksheetNotFound:
@@ -136,27 +239,305 @@ class SheetsService:
                          return ws
                     return None
             except Exception as e:
+                if self.requests.is_retryable(e) or not isinstance(e, gspread.exceptions.GSpreadException):
+                    raise # quota / server / network error: the request scheduler retries and records it
                 print(f"Error opening sheet {sheet_name_to_use}/{tab_name}: {e}")
+                if self._is_not_found(e):
+                    self._spreadsheets.pop(sheet_name_to_use, None)
                 return None
 
-        return await asyncio.to_thread(_get)
+        try:
+            with tracing.span("sheets.open", tab=tab_name):
+                ws = await self.requests.run(_get, priority, self._executor_for("open", tab_name))
+        except Exception as e:
+            print(f"Error opening sheet {sheet_name_to_use}/{tab_name}: {e}")
+            return None
+        if ws:
+            self._worksheets[key] = (ws, time.monotonic() + config.HANDLE_CACHE_TTL)
+        return ws
+
+    def _open_spreadsheet(self, sheet_name):
+        """Blocking. Returns a cached Spreadsheet handle or opens it (runs inside a worker thread)."""
+        cached = self._spreadsheets.get(sheet_name)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        sh = self.client.open(sheet_name)
+        self._spreadsheets[sheet_name] = (sh, time.monotonic() + config.HANDLE_CACHE_TTL)
+        return sh
+
+    def invalidate(self, sheet_name=None, tab_name=None):
+        """
+        Drops cached handles. No args clears everything; a tab_name drops only that tab.
+        """
+        if sheet_name is None and tab_name is None:
+            self._spreadsheets.clear()
+            self._worksheets.clear()
+            return
+        for key in list(self._worksheets):
+            if (sheet_name is None or key[0] == sheet_name) and (tab_name is None or key[1] == tab_name):
+                del self._worksheets[key]
+        if tab_name is None and sheet_name is not None:
+            self._spreadsheets.pop(sheet_name, None)
+
+    def cache_stats(self):
+        total = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": (self.cache_hits / total) if total else 0.0,
+            "cached_tabs": len(self._worksheets),
+        }
+
+    @staticmethod
+    def _is_not_found(exc):
+        if isinstance(exc, (gspread.WorksheetNotFound, gspread.SpreadsheetNotFound)):
+            return True
+        if isinstance(exc, gspread.exceptions.APIError):
+            response = getattr(exc, "response", None)
+            return getattr(response, "status_code", None) == 404
+        return False
+
+    def _executor_for(self, kind, tab=""):
+        async def _execute(fn):
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                result = await self.executor.run(fn, kind)
+                outcome = "ok"
+                return result
+            finally:
+                SHEETS_LATENCY.observe(time.perf_counter() - started, method=kind, tab=tab)
+                SHEETS_REQUESTS.inc(method=kind, tab=tab, outcome=outcome)
+        return _execute
+
+    async def _call(self, worksheet, fn, priority=None, kind="other"):
+        """
+        Runs a blocking gspread call through the request scheduler, on the Sheets pool.
+        `kind` names the call in the executor stats. If the tab turns out to be gone
+        (deleted/renamed -> 404), its cached handle is dropped before re-raising so
+        the next get_worksheet looks it up again.
+        """
+        if priority is None:
+            priority = PRIORITY_NORMAL
+        try:
+            tab = getattr(worksheet, "title", "")
+            # Span covers the quota wait and retries too, not just the HTTP call
+            with tracing.span(f"sheets.{kind}", tab=tab):
+                return await self.requests.run(fn, priority, self._executor_for(kind, tab))
+        except Exception as e:
+            if self._is_not_found(e):
+                self._invalidate_worksheet(worksheet)
+            raise
+
+    def _invalidate_worksheet(self, worksheet):
+        for key, (ws, _) in list(self._worksheets.items()):
+            if ws is worksheet:
+                del self._worksheets[key]
+                self._spreadsheets.pop(key[0], None)
+
+    async def append_row(self, worksheet, row_data, priority=PRIORITY_WRITE):
+        """
+        Queued; resolves once the batch holding this row has been appended, to the
+        sheet row it landed on (None if the response didn't say).
+        """
+        return await self.writes.append_row(worksheet, row_data, priority=priority)
+
+    async def append_rows(self, worksheet, rows, chunk_size=None, on_chunk=None, priority=PRIORITY_BULK):
+        """
+        Bulk append, bypassing the write queue: one API call per `chunk_size` rows
+        (config.SHEETS_APPEND_CHUNK by default). on_chunk(rows_done) is awaited after
+        each chunk so callers can checkpoint.
+        """
+        chunk_size = chunk_size or config.SHEETS_APPEND_CHUNK
+        done = 0
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
 
-    async def append_row(self, worksheet, row_data):
-        def _append():
-             worksheet.append_row(row_data)
-        await asyncio.to_thread(_append)
+            def _append(chunk=chunk):
+                worksheet.append_rows(chunk)
+            await self._call(worksheet, _append, priority, "append_rows")
+            done += len(chunk)
+            if on_chunk:
+                await on_chunk(done)
+        return done
 
-    async def get_all_records(self, worksheet):
+    async def get_all_records(self, worksheet, priority=PRIORITY_NORMAL):
         def _get():
             return worksheet.get_all_records()
-        return await asyncio.to_thread(_get)
+        return await self._call(worksheet, _get, priority, "get_all_records")
     
-    async def get_all_values(self, worksheet):
+    async def get_all_values(self, worksheet, priority=PRIORITY_NORMAL):
         def _get():
             return worksheet.get_all_values()
-        return await asyncio.to_thread(_get)
+        return await self._call(worksheet, _get, priority, "get_all_values")
+
+    async def get_values(self, worksheet, a1_range, priority=PRIORITY_NORMAL):
+        """Values of one A1 range (e.g. "A:A" or "A5:E5"); only those cells are downloaded."""
+        def _get():
+            return worksheet.get_values(a1_range)
+        return await self._call(worksheet, _get, priority, "get_values")
+
+    async def find_row(self, worksheet, key, col=1, priority=PRIORITY_NORMAL):
+        """
+        1-based index of the first row whose column `col` equals `key` (compared as
+        strings), or None. Downloads only that column.
+        """
+        letter = rowcol_to_a1(1, col)[:-1]
+        values = await self.get_values(worksheet, f"{letter}:{letter}", priority)
+        key = str(key)
+        for row_idx, r in enumerate(values, start=1):
+            if r and str(r[0]) == key:
+                return row_idx
+        return None
+
+    @staticmethod
+    def _snapshot_key(worksheet):
+        return (getattr(worksheet, "spreadsheet_id", None), getattr(worksheet, "id", id(worksheet)))
+
+    @staticmethod
+    def _modified_time(worksheet):
+        """Blocking. Drive modifiedTime of the whole spreadsheet, or None if it can't be read."""
+        try:
+            sh = worksheet.spreadsheet
+            getter = getattr(sh, "get_lastUpdateTime", None) # gspread 6
+            return getter() if getter else sh.lastUpdateTime
+        except Exception:
+            return None
+
+    async def get_values_if_changed(self, worksheet, force=False, priority=PRIORITY_NORMAL):
+        """
+        Conditional read of a whole tab.
+
+        Returns None when the tab is unchanged since the previous call for it. Otherwise
+        returns {"rows": all values, "inserted": [(row_idx, row)], "changed": [(row_idx, row)],
+        "removed": [row_idx]} relative to that previous read (row_idx is 1-based, header = 1).
+
+        The Drive modifiedTime is checked first; it covers the whole spreadsheet, so if
+        anything else moved, the tab is downloaded and compared by content hash before
+        diffing. force=True skips both checks and reports every row as inserted.
+        """
+        key = self._snapshot_key(worksheet)
+        prev = self._snapshots.get(key)
+
+        def _read():
+            modified = self._modified_time(worksheet)
+            if not force and prev and modified is not None and modified == prev["modified"]:
+                return modified, None
+            return modified, worksheet.get_all_values()
+
+        modified, rows = await self._call(worksheet, _read, priority, "get_values_if_changed")
+        if rows is None:
+            self.unchanged_reads += 1
+            return None
+
+        digest = hashlib.sha1(repr(rows).encode("utf-8")).hexdigest()
+        if not force and prev and digest == prev["hash"]:
+            prev["modified"] = modified
+            self.unchanged_reads += 1
+            return None
+
+        self._snapshots[key] = {"modified": modified, "hash": digest, "rows": rows}
+        self.changed_reads += 1
+
+        old_rows = prev["rows"] if prev and not force else []
+        inserted, changed = [], []
+        for i, row in enumerate(rows):
+            if i >= len(old_rows):
+                inserted.append((i + 1, row))
+            elif old_rows[i] != row:
+                changed.append((i + 1, row))
+        removed = list(range(len(rows) + 1, len(old_rows) + 1))
+        return {"rows": rows, "inserted": inserted, "changed": changed, "removed": removed}
+
+    async def update_cell(self, worksheet, row, col, value, priority=PRIORITY_WRITE):
+        """Queued; resolves once the batch holding this cell has been written."""
+        await self.writes.update_cell(worksheet, row, col, value, priority=priority)
+
+    async def flush(self):
+        """Pushes out any queued writes immediately."""
+        await self.writes.flush()
+
+    def request_stats(self):
+        """Queue depth and retry counters of the request scheduler, plus queued writes."""
+        stats = self.requests.stats()
+        stats["pending_writes"] = self.writes.pending()
+        return stats
+
+    def executor_stats(self):
+        """Per call kind: queue wait and execution time on the Sheets thread pool."""
+        return self.executor.stats()
+
+    def _collect_metrics(self):
+        requests = self.request_stats()
+        executor = self.executor.stats()
+        return [
+            ("sheets_handle_cache_total", "counter", "Worksheet handle lookups by result",
+             [({"result": "hit"}, self.cache_hits), ({"result": "miss"}, self.cache_misses)]),
+            ("sheets_conditional_reads_total", "counter", "get_values_if_changed() calls by result",
+             [({"result": "unchanged"}, self.unchanged_reads), ({"result": "changed"}, self.changed_reads)]),
+            ("sheets_queued_requests", "gauge", "Calls waiting for a quota token, by priority class",
+             [({"priority": str(p)}, n) for p, n in sorted(requests["queued_by_priority"].items())]),
+            ("sheets_in_flight_requests", "gauge", "Calls holding a token", [({}, requests["in_flight"])]),
+            ("sheets_retries_total", "counter", "429/5xx responses retried", [({}, requests["retries"])]),
+            ("sheets_throttled_total", "counter", "429 responses", [({}, requests["throttled"])]),
+            ("sheets_failed_total", "counter", "Calls that ran out of retries", [({}, requests["failed"])]),
+            ("sheets_quota_tokens", "gauge", "Tokens left in the quota bucket", [({}, requests["tokens"])]),
+            ("sheets_pending_writes", "gauge", "Writes waiting in the write-behind queue", [({}, requests["pending_writes"])]),
+            ("sheets_executor_threads", "gauge", "Sheets thread pool: running and queued calls",
+             [({"state": "running"}, executor["running"]), ({"state": "queued"}, executor["queued"])]),
+            ("sheets_token_refreshes_total", "counter", "Background access token refreshes", [({}, self.token_refreshes)]),
+        ]
+
+    async def close(self, timeout=10):
+        """
+        Flushes queued writes (up to `timeout` seconds; anything unsent stays in the
+        journal) and shuts the Sheets thread pool down.
+        """
+        try:
+            await asyncio.wait_for(self.flush(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Sheets flush timed out, {self.writes.pending()} writes left in the journal")
+        if self._refresh_task:
+            self._refresh_task.cancel()
+        self.executor.shutdown(wait=False)
+        if self.session:
+            self.session.close()
+        if self._token_request:
+            self._token_request.session.close()
+
+    async def replay_journal(self):
+        """
+        Re-queues writes that were journaled but never confirmed by a previous run, each
+        at its original priority, and flushes them right away. Runs once per process,
+        after connect(); sets `journal_done` when finished. Returns the number of writes
+        re-queued.
+        """
+        if self._journal_replayed or not self.client:
+            return 0
+        self._journal_replayed = True
+
+        try:
+            entries = self.journal.pending()
+            if not entries:
+                return 0
+            print(f"Replaying {len(entries)} unsent Sheets writes from the journal")
 
-    async def update_cell(self, worksheet, row, col, value):
-        def _update():
-            worksheet.update_cell(row, col, value)
-        await asyncio.to_thread(_update)
+            futures = []
+            for e in entries:
+                ws = await self.get_worksheet("DiscordBot", e["tab"])
+                if not ws:
+                    print(f"Journal replay: tab '{e['tab']}' not found, keeping entry {e['id']}")
+                    continue
+                priority = e.get("priority")
+                if e["kind"] == "cell":
+                    futures.append(self.writes.update_cell(ws, e["row"], e["col"], e["value"], journal_id=e["id"], priority=priority))
+                else:
+                    futures.append(self.writes.append_row(ws, e["data"], journal_id=e["id"], priority=priority))
+            await self.flush()
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            failed = sum(1 for r in results if isinstance(r, Exception))
+            if failed:
+                print(f"Journal replay: {failed} writes failed, will retry on next start")
+            return len(futures)
+        finally:
+            self.journal_done.set()
@@ -0,0 +1,114 @@
+import sqlite3
+import time
+
+class StreakStore:
+    """
+    Storage interface behind StreakService.
+
+    Entries are dicts {"row", "username", "last_active", "streak", "shown_date"} keyed
+    by user ID (str). `mirrored` tracks whether the Google Sheet already has the
+    latest version of an entry. This base class keeps nothing, i.e. the sheet is
+    the only copy (the original behaviour).
+    """
+    persistent = False
+
+    def load(self):
+        """Returns {user_id: entry}."""
+        return {}
+
+    def unmirrored(self):
+        """User IDs whose latest change has not reached the sheet yet."""
+        return set()
+
+    def save(self, user_id, entry, mirrored):
+        pass
+
+    def save_many(self, entries, mirrored):
+        """entries: {user_id: entry}"""
+        pass
+
+    def mark_mirrored(self, user_id):
+        pass
+
+    def delete(self, user_id):
+        pass
+
+    def close(self):
+        pass
+
+class SQLiteStreakStore(StreakStore):
+    """
+    Local SQLite (WAL) copy of the streaks; the source of truth when enabled.
+
+    Statements are tiny single-row upserts. With WAL and synchronous=NORMAL a commit
+    does not fsync, so they run inline on the event loop in microseconds.
+    """
+    persistent = True
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS streaks (
+                user_id TEXT PRIMARY KEY,
+                username TEXT NOT NULL DEFAULT '',
+                last_active TEXT NOT NULL DEFAULT '',
+                streak INTEGER NOT NULL DEFAULT 0,
+                shown_date TEXT NOT NULL DEFAULT '',
+                sheet_row INTEGER,
+                mirrored INTEGER NOT NULL DEFAULT 1,
+                updated_at REAL NOT NULL
+            )"""
+        )
+
+    def load(self):
+        cur = self.conn.execute(
+            "SELECT user_id, username, last_active, streak, shown_date, sheet_row FROM streaks"
+        )
+        return {
+            uid: {
+                "row": row,
+                "username": username,
+                "last_active": last_active,
+                "streak": streak,
+                "shown_date": shown_date,
+            }
+            for uid, username, last_active, streak, shown_date, row in cur
+        }
+
+    def unmirrored(self):
+        cur = self.conn.execute("SELECT user_id FROM streaks WHERE mirrored = 0")
+        return {uid for (uid,) in cur}
+
+    def _params(self, user_id, entry, mirrored):
+        return (
+            user_id, entry["username"], entry["last_active"], entry["streak"],
+            entry["shown_date"], entry["row"], 1 if mirrored else 0, time.time(),
+        )
+
+    _UPSERT = """INSERT INTO streaks (user_id, username, last_active, streak, shown_date, sheet_row, mirrored, updated_at)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                 ON CONFLICT(user_id) DO UPDATE SET
+                    username = excluded.username, last_active = excluded.last_active,
+                    streak = excluded.streak, shown_date = excluded.shown_date,
+                    sheet_row = excluded.sheet_row, mirrored = excluded.mirrored,
+                    updated_at = excluded.updated_at"""
+
+    def save(self, user_id, entry, mirrored):
+        self.conn.execute(self._UPSERT, self._params(user_id, entry, mirrored))
+
+    def save_many(self, entries, mirrored):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(self._UPSERT, [self._params(uid, e, mirrored) for uid, e in entries.items()])
+
+    def mark_mirrored(self, user_id):
+        self.conn.execute("UPDATE streaks SET mirrored = 1 WHERE user_id = ?", (user_id,))
+
+    def delete(self, user_id):
+        self.conn.execute("DELETE FROM streaks WHERE user_id = ?", (user_id,))
+
+    def close(self):
+        self.conn.close()
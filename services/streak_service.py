@@ -1,11 +1,311 @@
-import config
+import asyncio
 from datetime import datetime
-from services.sheets_service import SheetsService
+from services.sheets_service import SheetsService, PRIORITY_BULK
+from services.leaderboard import Leaderboard
+from services.storage import StreakStore
+from utils import metrics, time_utils
+
+# Streaks columns (1-based, as in the sheet): UserID, Username, LastActive, Streak, ShownDate
+COL_USERNAME = 2
+COL_LAST_ACTIVE = 3
+COL_STREAK = 4
+COL_SHOWN_DATE = 5
+LAST_COL = "E"
+
+FIELDS = ("username", "last_active", "streak", "shown_date")
 
 class StreakService:
-    def __init__(self, sheets_service: SheetsService):
+    def __init__(self, sheets_service: SheetsService, store: StreakStore = None):
         self.sheets = sheets_service
         self.tab_name = "Streaks"
+        # Source of truth when persistent (SQLite); the sheet is then an editable mirror
+        self.store = store or StreakStore()
+
+        # In-memory copy of the streaks: user_id (str) -> entry dict
+        # entry = {"row", "username", "last_active", "streak", "shown_date"}
+        self._index = {}
+        self._next_row = 2 # first free sheet row (row 1 is the header)
+        self._loaded = False
+        self._store_checked = False
+        self._sync_lock = asyncio.Lock()
+        self._unmirrored = set() # user_ids with local changes the sheet doesn't have yet
+        self._versions = {} # user_id -> local change counter
+        self._pending_writes = set()
+        self._appending = {} # user_id -> task appending their row (its real row number isn't known yet)
+        self._background_sync = None
+        self.leaderboard = Leaderboard(top_n=10)
+        self.projected_lookups = 0
+        metrics.add_collector(self._collect_metrics)
+
+    async def sync(self, force=False):
+        """
+        Reconciles the in-memory index (and the store) with the Streaks tab.
+        Called lazily on first use, periodically by StreaksCog and by /resyncstreaks (force).
+        Uses a conditional read, so an unchanged tab costs no download and only changed
+        rows are re-parsed. If the persistent store hasn't been loaded yet it is loaded
+        first, so unmirrored local changes are never lost to the sheet.
+
+        Edits made directly in the sheet win, except for users with local changes that
+        have not been mirrored yet: those keep the local values and are written again.
+        Returns the number of users loaded, or None if the sheet could not be read.
+        """
+        async with self._sync_lock:
+            if not self._loaded and self._load_store():
+                # Local changes must survive; the sheet only wins where it was edited
+                force = True
+            ws = await self.sheets.get_worksheet("DiscordBot", self.tab_name)
+            if not ws:
+                return None
+
+            # Make sure our own queued writes are in the sheet before reading it back
+            await self.sheets.flush()
+
+            full = force or not self._loaded
+            try:
+                # Background reconcile: yields to scheduler posts and writes
+                diff = await self.sheets.get_values_if_changed(ws, force=full, priority=PRIORITY_BULK)
+            except Exception as e:
+                print(f"Streak sync failed: {e}")
+                return None
+
+            if diff is None:
+                return len(self._index)
+
+            old = self._index
+            if full:
+                index = {}
+                updated = diff["inserted"]
+            else:
+                index = dict(old)
+                updated = diff["inserted"] + diff["changed"]
+                row_uid = {e["row"]: uid for uid, e in index.items()}
+                for row_idx in diff["removed"] + [row_idx for row_idx, _ in updated]:
+                    uid = row_uid.get(row_idx)
+                    if uid is not None and index.get(uid, {}).get("row") == row_idx:
+                        del index[uid]
+
+            accepted = {} # sheet edits to take over
+            remirror = [] # local changes the sheet is missing
+            for row_idx, r in updated:
+                if row_idx < 2 or not r or not r[0]: # header / blank
+                    continue
+                uid = str(r[0])
+                entry = self._entry_from_row(row_idx, r)
+                if uid in self._unmirrored and uid in old:
+                    local = dict(old[uid], row=row_idx)
+                    index[uid] = local
+                    if any(local[f] != entry[f] for f in FIELDS):
+                        remirror.append(uid)
+                else:
+                    index[uid] = entry
+                    accepted[uid] = entry
+
+            # Local users whose row is missing from the sheet (e.g. a lost append)
+            reappend = [uid for uid in self._unmirrored if uid in old and uid not in index]
+            for uid in reappend:
+                index[uid] = dict(old[uid])
+            dropped = [uid for uid in old if uid not in index]
+
+            self._index = index
+            self.store.save_many(accepted, mirrored=True)
+            for uid in dropped:
+                self.store.delete(uid)
+
+            if full:
+                self.leaderboard.rebuild(
+                    (uid, e["username"], e["streak"]) for uid, e in index.items()
+                )
+            else:
+                for uid in dropped:
+                    self.leaderboard.remove(uid)
+                for uid in list(accepted) + reappend:
+                    e = index[uid]
+                    self.leaderboard.update(uid, e["username"], e["streak"])
+
+            rows = diff["rows"]
+            self._next_row = max(len(rows) + 1, max((e["row"] for uid, e in index.items() if uid not in reappend), default=1) + 1)
+            self._loaded = True
+
+            for uid in reappend:
+                index[uid]["row"] = self._next_row
+                self._next_row += 1
+                self._persist(uid)
+                self._mirror_append(uid)
+            for uid in remirror:
+                e = index[uid]
+                self._persist(uid)
+                self._mirror(uid, {
+                    COL_USERNAME: e["username"], COL_LAST_ACTIVE: e["last_active"],
+                    COL_STREAK: e["streak"], COL_SHOWN_DATE: e["shown_date"],
+                })
+            return len(index)
+
+    def _collect_metrics(self):
+        return [
+            ("streak_users", "gauge", "Users in the streak index", [({}, len(self._index))]),
+            ("streak_unmirrored_users", "gauge", "Users with changes not yet in the sheet", [({}, len(self._unmirrored))]),
+            ("streak_projected_lookups_total", "counter", "Lookups served by range reads before the first sync",
+             [({}, self.projected_lookups)]),
+        ]
+
+    def _load_store(self):
+        """Loads the index from the persistent store, once. True if it had any users."""
+        if not self.store.persistent or self._store_checked:
+            return False
+        self._store_checked = True
+        index = self.store.load()
+        if not index:
+            return False
+        self._index = index
+        self._unmirrored = self.store.unmirrored()
+        self.leaderboard.rebuild((uid, e["username"], e["streak"]) for uid, e in index.items())
+        self._next_row = max((e["row"] or 1 for e in index.values()), default=1) + 1
+        self._loaded = True
+        return True
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return True
+
+        # Start from the local store; no sheet round trip on the hot path
+        if self._load_store():
+            # Pick up sheet edits made while we were offline
+            self._track(asyncio.ensure_future(self.sync(force=True)))
+            return True
+
+        await self.sync()
+        return self._loaded
+
+    async def _get_entry(self, uid):
+        """
+        The index entry for one user, None for an unknown user, or False if the sheet
+        can't be read.
+
+        Until the first full sync has finished, a user that isn't in the index yet is
+        looked up with projected reads (their UserID column, then just their row) while
+        the full sync runs in the background. Unknown users wait for the full sync,
+        since the row they get appended to depends on it.
+        """
+        if not self._loaded and self.store.persistent and not self._store_checked:
+            await self._ensure_loaded()
+        if self._loaded or uid in self._index:
+            return self._index.get(uid)
+
+        entry = await self._find_entry(uid)
+        if entry is not None:
+            return self._index.setdefault(uid, entry)
+        if not await self._ensure_loaded():
+            return False
+        return self._index.get(uid)
+
+    async def _find_entry(self, uid):
+        if self._background_sync is None or self._background_sync.done():
+            self._background_sync = asyncio.ensure_future(self.sync())
+            self._track(self._background_sync)
+
+        ws = await self.sheets.get_worksheet("DiscordBot", self.tab_name)
+        if not ws:
+            return None
+        try:
+            row_idx = await self.sheets.find_row(ws, uid)
+            if row_idx is None or row_idx < 2:
+                return None
+            rows = await self.sheets.get_values(ws, f"A{row_idx}:{LAST_COL}{row_idx}")
+        except Exception as e:
+            print(f"Streak lookup for {uid} failed: {e}")
+            return None
+        if not rows or not rows[0] or str(rows[0][0]) != uid:
+            return None # row moved between the two reads
+        self.projected_lookups += 1
+        return self._entry_from_row(row_idx, rows[0])
+
+    @staticmethod
+    def _entry_from_row(row_idx, r):
+        def get_col(idx):
+            return r[idx] if len(r) > idx else ""
+        try:
+            streak = int(get_col(3)) if get_col(3) else 0
+        except ValueError:
+            streak = 0
+        return {
+            "row": row_idx,
+            "username": get_col(1),
+            "last_active": get_col(2),
+            "streak": streak,
+            "shown_date": get_col(4),
+        }
+
+    def _persist(self, uid):
+        """Records a local change: store first (source of truth), sheet mirror follows."""
+        self._versions[uid] = self._versions.get(uid, 0) + 1
+        self._unmirrored.add(uid)
+        self.store.save(uid, self._index[uid], mirrored=False)
+
+    def _mirror(self, uid, cells):
+        """
+        Queues the changed cells of one user's row and returns immediately; the write
+        queue batches them. Once written, the user is marked mirrored (unless it changed
+        again meanwhile). A failed write triggers a resync on next use.
+        """
+        async def _write():
+            ws = await self.sheets.get_worksheet("DiscordBot", self.tab_name)
+            if not ws:
+                raise RuntimeError("Streaks sheet not available")
+            appending = self._appending.get(uid)
+            if appending:
+                # Wait for the row's real position before writing cells into it
+                await asyncio.shield(appending)
+            row_idx = self._index[uid]["row"]
+            await asyncio.gather(*[
+                self.sheets.update_cell(ws, row_idx, col, value) for col, value in cells.items()
+            ])
+        self._track(asyncio.ensure_future(_write()), uid)
+
+    def _mirror_append(self, uid):
+        """
+        Appends a new user's row. Sheets puts it after the table it detects (blank or
+        formatted rows can move it), so the row in the index is only a guess until the
+        append response gives the real one.
+        """
+        e = self._index[uid]
+        guessed = e["row"]
+        row = [uid, e["username"], e["last_active"], e["streak"], e["shown_date"]]
+
+        async def _write():
+            try:
+                ws = await self.sheets.get_worksheet("DiscordBot", self.tab_name)
+                if not ws:
+                    raise RuntimeError("Streaks sheet not available")
+                row_idx = await self.sheets.append_row(ws, row)
+                current = self._index.get(uid)
+                if row_idx and current is not None and current["row"] == guessed and row_idx != guessed:
+                    current["row"] = row_idx
+                    self.store.save(uid, current, mirrored=False)
+                if row_idx:
+                    self._next_row = max(self._next_row, row_idx + 1)
+            finally:
+                if self._appending.get(uid) is task:
+                    del self._appending[uid]
+
+        task = asyncio.ensure_future(_write())
+        self._appending[uid] = task
+        self._track(task, uid)
+
+    def _track(self, task, uid=None):
+        self._pending_writes.add(task)
+        version = self._versions.get(uid)
+
+        def _done(t):
+            self._pending_writes.discard(t)
+            if t.cancelled():
+                return
+            if t.exception():
+                print(f"Streak write-back failed, will resync: {t.exception()}")
+                self._loaded = False
+            elif uid is not None and self._versions.get(uid) == version:
+                self._unmirrored.discard(uid)
+                self.store.mark_mirrored(uid)
+        task.add_done_callback(_done)
 
     async def update_streak(self, user_id, username):
         """
@@ -15,130 +315,121 @@ class StreakService:
         - If LastActive was yesterday, streak += 1.
         - If LastActive was older, streak = 1.
         - Update LastActive = Today.
-        
+
         Wait, the prompt says:
         "One streak '🔥 …' message per user per day (use ShownDate to prevent duplicates)"
         "Persist in Google Sheet... Columns: UserID, Username, LastActive, Streak, ShownDate"
         "Commands: /streak -> show current streak (should also update/touch streak like current behavior)"
-        
-        So this method is called by /streak OR by the daily message logic? 
+
+        So this method is called by /streak OR by the daily message logic?
         Actually, the "Streak system" bullet says:
         "Only track messages in STREAK_CHANNEL_ID" -> So normal messages trigger it?
         AND "Commands... /streak -> show... also update/touch".
-        
+
         So we need a generic "touch_streak" method.
+
+        Served from the in-memory index (persisted to the store); only the cells that
+        changed are queued back to the sheet.
         """
-        ws = await self.sheets.get_worksheet("DiscordBot", self.tab_name)
-        if not ws:
+        uid = str(user_id)
+        entry = await self._get_entry(uid)
+        if entry is False:
             return None, None # Sheet error
-        
-        # Get all data
-        records = await self.sheets.get_all_values(ws)
-        # Assuming header row 1
-        header = records[0]
-        rows = records[1:]
-        
-        now = config.get_current_time() # Naive local time
+
+        now = time_utils.get_current_time() # Naive local time
         today_str = now.strftime("%Y-%m-%d")
-        
-        # Find user row
-        user_row_idx = -1
-        # Columns: UserID (0), Username (1), LastActive (2), Streak (3), ShownDate (4)
-        for i, r in enumerate(rows):
-            if str(r[0]) == str(user_id):
-                user_row_idx = i + 2 # 1-based, +1 for header
-                current_user_data = r
-                break
-        
+
+        if entry is None:
+            # New User
+            entry = {
+                "row": self._next_row,
+                "username": username,
+                "last_active": today_str,
+                "streak": 1,
+                "shown_date": "",
+            }
+            self._next_row += 1
+            self._index[uid] = entry
+            self.leaderboard.update(uid, username, 1)
+            self._persist(uid)
+            self._mirror_append(uid)
+            return 1, ""
+
         new_streak = 1
-        
-        if user_row_idx != -1:
-            # User exists
-            last_active = current_user_data[2]
-            current_streak = int(current_user_data[3]) if current_user_data[3] else 0
-            
-            # Check dates
-            if last_active:
+        last_active = entry["last_active"]
+        if last_active:
+            try:
                 last_date = datetime.strptime(last_active, "%Y-%m-%d")
-                # Diff
                 diff = (now - last_date).days
-                if diff == 0:
-                    # Same day
-                    new_streak = current_streak
-                elif diff == 1:
-                    # Yesterday
-                    new_streak = current_streak + 1
-                else:
-                    # Broken streak
-                    new_streak = 1
-            else:
-                new_streak = 1
-            
-            # Update row
-            # Helper to update multiple cells? Or just recreate row?
-            # gspread update_cell is slow one by one. 
-            # Ideally use batch update or just update specific cells. 
-            # Update LastActive, Streak, Username
-            # Columns 2, 3, 4 (1-indexed based on list, but GSheet is 1-indexed)
-            # Username=Col 2, LastActive=Col 3, Streak=Col 4
-            
-            await self.sheets.update_cell(ws, user_row_idx, 2, username)
-            await self.sheets.update_cell(ws, user_row_idx, 3, today_str)
-            await self.sheets.update_cell(ws, user_row_idx, 4, new_streak)
-            
-            # Return streak and shown_date for caller to decide on messaging
-            shown_date = current_user_data[4] if len(current_user_data) > 4 else ""
-            return new_streak, shown_date
-            
-        else:
-            # New User
-            row = [str(user_id), username, today_str, 1, ""]
-            await self.sheets.append_row(ws, row)
-            return 1, ""
+            except ValueError:
+                diff = None
+            if diff == 0:
+                # Same day
+                new_streak = entry["streak"]
+            elif diff == 1:
+                # Yesterday
+                new_streak = entry["streak"] + 1
+
+        # Only write what actually changed
+        dirty = {}
+        if entry["username"] != username:
+            entry["username"] = username
+            dirty[COL_USERNAME] = username
+        if entry["last_active"] != today_str:
+            entry["last_active"] = today_str
+            dirty[COL_LAST_ACTIVE] = today_str
+        if entry["streak"] != new_streak:
+            entry["streak"] = new_streak
+            dirty[COL_STREAK] = new_streak
+        if dirty:
+            self.leaderboard.update(uid, entry["username"], entry["streak"])
+            self._persist(uid)
+            self._mirror(uid, dirty)
+
+        # Return streak and shown_date for caller to decide on messaging
+        return new_streak, entry["shown_date"]
 
     async def mark_shown(self, user_id, date_str):
         """Updates ShownDate to prevent duplicate messages."""
-        ws = await self.sheets.get_worksheet("DiscordBot", self.tab_name)
-        if not ws: return
-        
-        rows = await self.sheets.get_all_values(ws)
-        for i, r in enumerate(rows[1:]):
-            if str(r[0]) == str(user_id):
-                row_idx = i + 2
-                await self.sheets.update_cell(ws, row_idx, 5, date_str) # Col 5 is ShownDate
-                break
+        uid = str(user_id)
+        entry = await self._get_entry(uid)
+        if not entry or entry["shown_date"] == date_str:
+            return
+        entry["shown_date"] = date_str
+        self._persist(uid)
+        self._mirror(uid, {COL_SHOWN_DATE: date_str})
 
     async def reset_streak(self, user_id):
-        ws = await self.sheets.get_worksheet("DiscordBot", self.tab_name)
-        if not ws: return False
-        
-        rows = await self.sheets.get_all_values(ws)
-        for i, r in enumerate(rows[1:]):
-            if str(r[0]) == str(user_id):
-                row_idx = i + 2
-                today_str = config.get_current_time().strftime("%Y-%m-%d")
-                await self.sheets.update_cell(ws, row_idx, 3, today_str) # LastActive today
-                await self.sheets.update_cell(ws, row_idx, 4, 0) # Streak 0
-                await self.sheets.update_cell(ws, row_idx, 5, "") # Clear ShownDate
-                return True
-        return False
+        uid = str(user_id)
+        entry = await self._get_entry(uid)
+        if not entry:
+            return False
+        today_str = time_utils.get_current_time().strftime("%Y-%m-%d")
+        entry.update(last_active=today_str, streak=0, shown_date="")
+        self.leaderboard.update(uid, entry["username"], 0)
+        self._persist(uid)
+        self._mirror(uid, {
+            COL_LAST_ACTIVE: today_str, # LastActive today
+            COL_STREAK: 0, # Streak 0
+            COL_SHOWN_DATE: "", # Clear ShownDate
+        })
+        return True
 
     async def get_top_streaks(self, limit=10):
+        """Top streaks as [{'Username', 'Streak', 'UserID'}], served from the in-memory leaderboard."""
         try:
-            ws = await self.sheets.get_worksheet("DiscordBot", self.tab_name)
-            if not ws: return []
-            
-            records = await self.sheets.get_all_records(ws) 
-            # Sort by Streak desc
-            # Ensure Streak is int
-            for r in records:
-                try:
-                    r['Streak'] = int(r['Streak'])
-                except:
-                    r['Streak'] = 0
-            
-            sorted_recs = sorted(records, key=lambda x: x['Streak'], reverse=True)
-            return sorted_recs[:limit]
+            if not await self._ensure_loaded():
+                return []
+            return [
+                {"UserID": uid, "Username": username, "Streak": streak}
+                for uid, username, streak in self.leaderboard.top(limit)
+            ]
         except Exception as e:
             print(f"Error getting top streaks: {e}")
             return []
+
+    async def get_rank(self, user_id):
+        """Returns (rank, total_users); rank is None if the user has no streak entry."""
+        if not await self._ensure_loaded():
+            return None, 0
+        return self.leaderboard.rank(str(user_id)), len(self.leaderboard)
@@ -0,0 +1,160 @@
+import asyncio
+import re
+from gspread.utils import rowcol_to_a1
+import config
+
+_RANGE_START_ROW = re.compile(r"![A-Z]+(\d+)")
+
+def _appended_rows(response, count):
+    """
+    Sheet rows the appended rows actually landed on, from the append response
+    ({"updates": {"updatedRange": "Tab!A12:E14"}}). Sheets appends after the table
+    it detects, which isn't necessarily the row after the last one we know of.
+    """
+    try:
+        match = _RANGE_START_ROW.search(response["updates"]["updatedRange"])
+    except (TypeError, KeyError):
+        match = None
+    if not match:
+        return [None] * count
+    start = int(match.group(1))
+    return [start + i for i in range(count)]
+
+class _PendingWrites:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.cells = {} # (row, col) -> value (last write wins)
+        self.cell_futures = []
+        self.cell_journal_ids = []
+        self.rows = []
+        self.row_futures = []
+        self.row_journal_ids = []
+        self.priority = None # most urgent priority among the queued writes
+        self.timer = None
+
+    def __len__(self):
+        return len(self.cells) + len(self.rows)
+
+class WriteQueue:
+    """
+    Write-behind queue for Sheets mutations.
+
+    Cell updates and row appends are gathered per worksheet and sent as one
+    batch_update / append_rows call after `flush_interval` seconds, or as soon as
+    `max_batch` writes are pending. Every enqueue returns a future that resolves
+    once the batch containing it has been written (or raises if it failed); for
+    appends it resolves to the sheet row the row was written to (None if unknown).
+    """
+    def __init__(self, run, flush_interval=None, max_batch=None, journal=None):
+        # run(worksheet, fn, priority, kind) -> awaitable; executes a blocking gspread call off the loop
+        self._run = run
+        # Optional WriteJournal: every write is recorded before queueing, acked once sent
+        self.journal = journal
+        self.flush_interval = flush_interval if flush_interval is not None else config.WRITE_FLUSH_INTERVAL
+        self.max_batch = max_batch if max_batch is not None else config.WRITE_BATCH_MAX
+        self._pending = {} # id(worksheet) -> _PendingWrites
+        self._inflight = set()
+        self.api_calls = 0
+        self.writes = 0
+
+    def update_cell(self, worksheet, row, col, value, journal_id=None, priority=None):
+        batch = self._batch_for(worksheet, priority)
+        fut = asyncio.get_running_loop().create_future()
+        if self.journal and journal_id is None:
+            journal_id = self.journal.record_cell(worksheet.title, row, col, value, priority=priority)
+        if journal_id is not None:
+            batch.cell_journal_ids.append(journal_id)
+        batch.cells[(row, col)] = value
+        batch.cell_futures.append(fut)
+        self._after_enqueue(batch)
+        return fut
+
+    def append_row(self, worksheet, row_data, journal_id=None, priority=None):
+        batch = self._batch_for(worksheet, priority)
+        fut = asyncio.get_running_loop().create_future()
+        if self.journal and journal_id is None:
+            journal_id = self.journal.record_row(worksheet.title, list(row_data), priority=priority)
+        if journal_id is not None:
+            batch.row_journal_ids.append(journal_id)
+        batch.rows.append(list(row_data))
+        batch.row_futures.append(fut)
+        self._after_enqueue(batch)
+        return fut
+
+    def pending(self):
+        return sum(len(b) for b in self._pending.values())
+
+    async def flush(self, worksheet=None):
+        """Flushes pending writes now (one worksheet, or all) and waits for in-flight batches."""
+        if worksheet is not None:
+            keys = [id(worksheet)]
+        else:
+            keys = list(self._pending)
+        tasks = [self._flush_key(k) for k in keys]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._inflight:
+            await asyncio.gather(*list(self._inflight), return_exceptions=True)
+
+    def _batch_for(self, worksheet, priority):
+        batch = self._pending.get(id(worksheet))
+        if batch is None:
+            batch = _PendingWrites(worksheet)
+            self._pending[id(worksheet)] = batch
+        if priority is not None and (batch.priority is None or priority < batch.priority):
+            batch.priority = priority
+        return batch
+
+    def _after_enqueue(self, batch):
+        self.writes += 1
+        key = id(batch.worksheet)
+        if len(batch) >= self.max_batch:
+            self._spawn(key)
+        elif batch.timer is None:
+            loop = asyncio.get_running_loop()
+            batch.timer = loop.call_later(self.flush_interval, self._spawn, key)
+
+    def _spawn(self, key):
+        task = asyncio.get_running_loop().create_task(self._flush_key(key))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _flush_key(self, key):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer:
+            batch.timer.cancel()
+
+        ws = batch.worksheet
+        # Appends go first: a queued cell update may target a row that is still
+        # being appended, and writing it early would push the append one row down.
+        if batch.rows:
+            rows = batch.rows
+            await self._send(
+                ws, lambda: ws.append_rows(rows), batch.row_futures, batch.row_journal_ids, batch.priority,
+                "append_rows", results=lambda response: _appended_rows(response, len(rows)),
+            )
+        if batch.cells:
+            data = [
+                {"range": rowcol_to_a1(r, c), "values": [[v]]}
+                for (r, c), v in batch.cells.items()
+            ]
+            await self._send(ws, lambda: ws.batch_update(data, value_input_option="USER_ENTERED"), batch.cell_futures, batch.cell_journal_ids, batch.priority, "batch_update")
+
+    async def _send(self, worksheet, fn, futures, journal_ids=(), priority=None, kind="other", results=None):
+        self.api_calls += 1
+        try:
+            response = await self._run(worksheet, fn, priority, kind)
+            if self.journal and journal_ids:
+                self.journal.ack(journal_ids)
+        except Exception as e:
+            print(f"Batched write to '{getattr(worksheet, 'title', '?')}' failed: {e}")
+            for f in futures:
+                if not f.done():
+                    f.set_exception(e)
+            return
+        values = results(response) if results else [None] * len(futures)
+        for f, value in zip(futures, values):
+            if not f.done():
+                f.set_result(value)
@@ -10,16 +10,27 @@ def convert_drive_url(url: str) -> str:
     if not url:
         return url
 
+    file_id = extract_file_id(url)
+    if file_id:
+        return f"https://drive.google.com/uc?export=download&id={file_id}"
+
+    return url
+
+def extract_file_id(url: str) -> str:
+    """
+    Returns the Drive file ID from a view/open/download URL, or None if it isn't one.
+    """
+    if not url:
+        return None
+
     # Regex for file/d/ID
     file_id_match = re.search(r'/file/d/([a-zA-Z0-9_-]+)', url)
     if file_id_match:
-        file_id = file_id_match.group(1)
-        return f"https://drive.google.com/uc?export=download&id={file_id}"
+        return file_id_match.group(1)
 
-    # Regex for open?id=ID
+    # Regex for open?id=ID (also matches uc?export=download&id=ID)
     id_param_match = re.search(r'[?&]id=([a-zA-Z0-9_-]+)', url)
     if id_param_match:
-        file_id = id_param_match.group(1)
-        return f"https://drive.google.com/uc?export=download&id={file_id}"
+        return id_param_match.group(1)
 
-    return url
+    return None
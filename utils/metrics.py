@@ -0,0 +1,146 @@
+import math
+import threading
+
+# Seconds; covers everything from a cached lookup to a slow Sheets call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {} # label values tuple -> value
+        self._lock = threading.Lock() # Sheets executor threads record too
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def samples(self):
+        """[(suffix, labels dict, value)]"""
+        with self._lock:
+            items = list(self._values.items())
+        return [("", dict(zip(self.label_names, key)), value) for key, value in items]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["counts"][i] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, dict(e, counts=list(e["counts"]))) for key, e in self._values.items()]
+        out = []
+        for key, e in items:
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, e["counts"]):
+                cumulative += n
+                out.append(("_bucket", dict(labels, le=_format_value(float(bound))), cumulative))
+            out.append(("_sum", labels, e["sum"]))
+            out.append(("_count", labels, e["count"]))
+        return out
+
+class Registry:
+    """
+    Process-wide metrics in Prometheus text format (served at /metrics).
+
+    Hot paths record into counters / histograms as they go. Stats that services
+    already keep (cache hits, queue depths) are read at scrape time by collectors:
+    callables returning [(name, kind, help, [(labels dict, value)])].
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = cls(name, help_text, labels, **kwargs)
+            self._metrics[name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Metrics collector {collector!r} failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+add_collector = REGISTRY.add_collector
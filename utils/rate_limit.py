@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, bursts of up to `capacity`.
+    `acquire()` waits until a token is available. The rate can be changed on the fly.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens=1):
+        async with self._lock: # first come, first served
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def refund(self, tokens=1):
+        """Gives back tokens that were acquired but not used."""
+        self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def drain(self):
+        """Empties the bucket, e.g. after being told to back off."""
+        self._refill()
+        self._tokens = 0
+
+    def available(self):
+        self._refill()
+        return self._tokens
+
+class AdaptiveRate:
+    """
+    AIMD controller for a TokenBucket: halve the rate on a rate-limit response,
+    creep back up by `step` after each `window` successes, within [min_rate, max_rate].
+    """
+    def __init__(self, bucket: TokenBucket, min_rate, max_rate, step=0.1, window=20):
+        self.bucket = bucket
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.step = step
+        self.window = window
+        self._streak = 0
+
+    def success(self):
+        self._streak += 1
+        if self._streak >= self.window:
+            self._streak = 0
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + self.step)
+
+    def throttled(self):
+        self._streak = 0
+        self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+        self.bucket.drain()
@@ -0,0 +1,139 @@
+import functools
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import config
+
+_current = ContextVar("trace", default=None)
+
+MAX_SPANS = 50 # per trace, so a runaway loop can't grow one without bound
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.wall_time = time.time()
+        self.duration = None
+        self.spans = [] # (name, offset, duration, attrs, error)
+        self.error = False
+        self.dropped_spans = 0
+
+    @property
+    def finished(self):
+        return self.duration is not None
+
+    def add_span(self, name, start, duration, attrs, error):
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        self.spans.append((name, start - self.started, duration, attrs, error))
+
+class Tracer:
+    """
+    In-process span tracing, no backend: finished traces go to a ring buffer and
+    each trace name keeps its recent durations for percentiles (see /botstats).
+
+    A trace is tied to the current task through a ContextVar, so span() anywhere
+    below a command or listener (e.g. inside SheetsService) lands in its trace.
+    """
+    def __init__(self, buffer_size, samples):
+        self.recent = deque(maxlen=buffer_size)
+        self._samples_per_name = samples
+        self._durations = {} # name -> deque of seconds
+        self._counts = {} # name -> total finished traces
+
+    def finish(self, trace):
+        if trace.finished:
+            return
+        trace.duration = time.perf_counter() - trace.started
+        durations = self._durations.get(trace.name)
+        if durations is None:
+            durations = deque(maxlen=self._samples_per_name)
+            self._durations[trace.name] = durations
+        durations.append(trace.duration)
+        self._counts[trace.name] = self._counts.get(trace.name, 0) + 1
+        # Listener fast paths finish in microseconds; only keep traces that did something
+        if trace.spans or trace.duration >= 0.001:
+            self.recent.append(trace)
+
+    @staticmethod
+    def _percentile(ordered, p):
+        # Nearest rank
+        idx = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[idx]
+
+    def percentiles(self):
+        """{name: {"count", "p50", "p95", "p99"}} over each name's recent durations (seconds)."""
+        out = {}
+        for name, durations in self._durations.items():
+            ordered = sorted(durations)
+            out[name] = {
+                "count": self._counts[name],
+                "p50": self._percentile(ordered, 50),
+                "p95": self._percentile(ordered, 95),
+                "p99": self._percentile(ordered, 99),
+            }
+        return out
+
+    def mark_failed(self, trace):
+        """Flags a trace as failed after the fact (errors can surface after it finished)."""
+        trace.error = True
+        if trace.finished and trace not in self.recent:
+            self.recent.append(trace)
+
+    def slowest(self, limit=5):
+        return sorted(self.recent, key=lambda t: t.duration, reverse=True)[:limit]
+
+TRACER = Tracer(config.TRACE_BUFFER_SIZE, config.TRACE_SAMPLES)
+
+def begin(name):
+    """Starts a trace for the current task (paired with end())."""
+    trace = Trace(name)
+    _current.set(trace)
+    return trace
+
+def end(error=False):
+    trace = _current.get()
+    if trace is None:
+        return None
+    trace.error = trace.error or error
+    TRACER.finish(trace)
+    _current.set(None)
+    return trace
+
+def traced(name):
+    """Decorator for listeners and other coroutines that should be their own trace."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            trace = Trace(name)
+            token = _current.set(trace)
+            try:
+                return await fn(*args, **kwargs)
+            except BaseException:
+                trace.error = True
+                raise
+            finally:
+                TRACER.finish(trace)
+                _current.reset(token)
+        return wrapper
+    return decorator
+
+@contextmanager
+def span(name, **attrs):
+    """Times a block as a span of the current trace; a no-op outside of one."""
+    trace = _current.get()
+    if trace is None or trace.finished:
+        yield
+        return
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        trace.add_span(name, started, time.perf_counter() - started, attrs, error)
@@ -1,19 +1,91 @@
-from flask import Flask
-from threading import Thread
+import math
+import time
 from datetime import datetime
+from aiohttp import web
 import config
+from utils import metrics
 
-app = Flask(__name__)
+class HealthServer:
+    """
+    Keep-alive / health HTTP server, running as an aiohttp app on the bot's own loop.
 
-@app.route('/')
-def home():
-    now = datetime.now()
-    return f"I'm alive. Ping from {config.PORT}. Time: {now}"
+    /        plain "alive" page (uptime pingers)
+    /healthz loop responsiveness, gateway connection and Sheets reachability; 503 if any fails
+    /readyz  cheap readiness check for orchestrators: logged in and Sheets connected
+    /metrics Prometheus text format (utils.metrics)
+    """
+    def __init__(self, bot, sheets, loop_monitor):
+        self.bot = bot
+        self.sheets = sheets
+        self.loop_monitor = loop_monitor
+        self.app = web.Application()
+        self.app.router.add_get("/", self.home)
+        self.app.router.add_get("/healthz", self.healthz)
+        self.app.router.add_get("/readyz", self.readyz)
+        self.app.router.add_get("/metrics", self.metrics)
+        self.runner = None
 
-def run():
-    # Run on 0.0.0.0 to be accessible
-    app.run(host='0.0.0.0', port=config.PORT)
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "0.0.0.0", config.PORT)
+        try:
+            await site.start()
+        except OSError as e:
+            # Not worth taking the bot down for
+            print(f"Health server could not listen on port {config.PORT}: {e}")
+            return
+        print(f"Health server listening on port {config.PORT}")
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    def _loop_check(self):
+        # The monitor's tick stops when the loop is wedged; compare against the last one
+        s = self.loop_monitor.stats()
+        ok = s["since_tick"] < config.HEALTH_LOOP_STALL_SECONDS and s["lag"] < config.HEALTH_LOOP_STALL_SECONDS
+        return {
+            "ok": ok,
+            "lag_ms": round(s["lag"] * 1000, 1),
+            "max_lag_ms": round(s["max_lag"] * 1000, 1),
+            "since_tick_s": round(s["since_tick"], 1),
+            "slow_callbacks": s["slow_callbacks"],
+        }
+
+    def _gateway_check(self):
+        latency = self.bot.latency
+        connected = self.bot.is_ready() and not self.bot.is_closed() and math.isfinite(latency)
+        return {"ok": connected, "latency_ms": round(latency * 1000, 1) if math.isfinite(latency) else None}
+
+    def _sheets_check(self):
+        # Passive: based on the outcome of real traffic, so health checks cost no quota
+        requests = self.sheets.requests
+        now = time.monotonic()
+        failing = requests.last_failure is not None and (
+            requests.last_success is None or requests.last_failure > requests.last_success
+        )
+        return {
+            "ok": self.sheets.client is not None and not failing,
+            "connected": self.sheets.client is not None,
+            "since_success_s": round(now - requests.last_success, 1) if requests.last_success else None,
+            "last_error": requests.last_error if failing else None,
+        }
+
+    async def home(self, request):
+        return web.Response(text=f"I'm alive. Ping from {config.PORT}. Time: {datetime.now()}")
+
+    async def healthz(self, request):
+        checks = {"loop": self._loop_check(), "gateway": self._gateway_check(), "sheets": self._sheets_check()}
+        ok = all(c["ok"] for c in checks.values())
+        return web.json_response({"ok": ok, "checks": checks}, status=200 if ok else 503)
+
+    async def readyz(self, request):
+        ready = self.bot.is_ready() and self.sheets.client is not None
+        return web.Response(text="ready" if ready else "not ready", status=200 if ready else 503)
+
+    async def metrics(self, request):
+        return web.Response(
+            body=metrics.REGISTRY.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )